@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmaio, выполнение программ в asyncio, ввод и вывод через асинхронные каналы
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# setup
+
+QUANTUM = 1000      # codes run between turns of the event loop
+
+# --------------------------------------------------------------
+# imports
+
+import io
+import sys
+import asyncio
+import argparse
+
+from ksmr import VM, Output, Input, LoadError
+import ksmobj
+from ksmlog import logger
+import ksmlog
+
+# --------------------------------------------------------------
+# channels: input has async readline() -> line or None at end,
+# output has async write(text)
+
+class QueueChannel:
+    """lines through an asyncio.Queue: program input takes them,
+    program output puts text; None in the queue ends input
+    """
+
+    def __init__(self, queue: asyncio.Queue | None = None):
+        self.queue = queue if queue is not None else asyncio.Queue()
+
+    async def readline(self) -> str | None:
+        return await self.queue.get()
+
+    async def write(self, text: str) -> None:
+        await self.queue.put(text)
+
+class StreamInput:
+    """program input from an asyncio.StreamReader, a line at a time"""
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+
+    async def readline(self) -> str | None:
+        line = await self.reader.readline()
+        if not line:
+            return None
+        return line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+class StreamOutput:
+    """program output to an asyncio.StreamWriter, waits while it is full"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+
+    async def write(self, text: str) -> None:
+        self.writer.write(text.encode('utf-8'))
+        await self.writer.drain()
+
+class ConsoleChannel:
+    """program input from stdin and output to stdout; stdin may be a
+    file, which the event loop can not watch, so lines are read in a thread
+    """
+
+    async def readline(self) -> str | None:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            return None
+        return line.rstrip('\r\n')
+
+    async def write(self, text: str) -> None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+# --------------------------------------------------------------
+# run a program
+
+async def run(cf, inp, out, max_steps: int | None = None, quantum: int = QUANTUM) -> VM:
+    """run code file cf on the event loop, quantum codes at a time, letting
+    other tasks run in between; input lines are awaited from channel inp
+    when the program wants them, output goes to channel out after each
+    quantum and before input; return the machine when it is done
+    (stopped, error, or paused after max_steps codes)
+    """
+
+    sink = io.StringIO()
+    vm = VM(Output(stdout=False, file=sink), inp=Input(interactive=False))
+    vm.load(cf)
+
+    while True:
+        n = quantum if max_steps is None else min(quantum, max_steps - vm.steps)
+        state = vm.run(n)
+
+        text = sink.getvalue()
+        if text:
+            sink.seek(0)
+            sink.truncate()
+            await out.write(text)
+
+        match state:
+            case 'blocked':
+                line = await inp.readline()
+                if line is None:
+                    vm.state = 'error'
+                    vm.error = "End of input"
+                    return vm
+                vm.inp.push(line)
+            case 'paused' if max_steps is not None and vm.steps >= max_steps:
+                return vm
+            case 'paused':
+                await asyncio.sleep(0)
+            case _:
+                return vm
+
+# --------------------------------------------------------------
+# command line
+
+async def serve(cf, host: str, port: int, max_steps: int | None) -> None:
+    """run the program for each connection, talking to it over the connection"""
+
+    # a bad code file fails here, once, and not in every session
+    VM(Output(stdout=False)).load(cf)
+
+    async def session(reader, writer):
+        peer = writer.get_extra_info('peername')
+        logger.info(f"Session from {peer}")
+        try:
+            vm = await run(cf, StreamInput(reader), StreamOutput(writer), max_steps)
+            logger.info(f"Session from {peer}: {vm.state}, {vm.steps} codes")
+        except ConnectionError as e:
+            logger.info(f"Session from {peer}: client went away ({e})")
+        except Exception as e:
+            logger.error(f"Session from {peer}: {type(e).__name__}: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    server = await asyncio.start_server(session, host, port)
+    logger.info(f"Serving on {host}:{port}")
+    print(f"Serving on {host}:{port}, Ctrl-C to stop.")
+    async with server:
+        await server.serve_forever()
+
+def main(argv: list[str] | None = None) -> None:
+    """run program named in command line (default prog01) on asyncio"""
+
+    parser = argparse.ArgumentParser(description="Run a stack machine program on asyncio")
+    parser.add_argument('program', nargs='?', default='prog01',
+                        help="program name, extension is ignored")
+    parser.add_argument('--steps', type=int, default=None,
+                        help="stop after this many codes")
+    parser.add_argument('--port', type=int, default=None,
+                        help="serve the program on localhost TCP port, a session per connection")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to serve on (default 127.0.0.1)")
+    args = parser.parse_args(argv)
+
+    inout = args.program
+
+    if len(inout) > 4 and inout[-4] == '.':
+        inout = inout[:-4]
+
+    inname = inout + '.smb'      # state machine program binary
+
+    ksmlog.setup((sys.stderr, 'INFO' if args.port else 'WARNING'))
+
+    cf = ksmobj.map_file(inname)
+
+    try:
+        if args.port is not None:
+            asyncio.run(serve(cf, args.host, args.port, args.steps))
+        else:
+            console = ConsoleChannel()
+            vm = asyncio.run(run(cf, console, console, args.steps))
+            if vm.state == 'error':
+                print(f"\nError: {vm.error}")
+                raise SystemExit(1)
+            print()
+    except LoadError as e:
+        print(e)
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
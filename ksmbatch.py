@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmbatch, пакетный запуск многих программ
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# setup
+
+SLICE = 10000       # codes run between wall clock checks
+
+# --------------------------------------------------------------
+# imports
+
+import os
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from ksmr import VM, Output, Input, LoadError
+import ksmlog
+
+# --------------------------------------------------------------
+# one program, in a worker process
+
+def init_worker() -> None:
+    """worker start up: errors go to results, not to the log"""
+
+    ksmlog.setup()
+
+def run_limited(vm: VM, max_steps: int | None = None, deadline: float | None = None) -> str:
+    """run loaded machine vm in slices, to watch the step limit and the clock
+    (deadline is time.perf_counter() to stop at); return why it ended:
+    its state (stopped, error, blocked), steps or timeout
+    """
+
+    while True:
+        n = SLICE
+        if max_steps is not None:
+            n = min(n, max_steps - vm.steps)
+        state = vm.run(n)
+        if state != 'paused':
+            return state
+        if max_steps is not None and vm.steps >= max_steps:
+            return 'steps'
+        if deadline is not None and time.perf_counter() > deadline:
+            return 'timeout'
+
+def run_one(name: str, max_steps: int | None, timeout: float | None) -> dict:
+    """run program name (.smb), return what happened as a dict"""
+
+    result = {'program': name, 'reason': None, 'error': None,
+              'steps': 0, 'output': '', 'elapsed': 0.0}
+
+    t0 = time.perf_counter()
+    out = Output(stdout=False, capture=True)
+    vm = VM(out, inp=Input(interactive=False))     # no one to type input: blocked
+
+    try:
+        vm.load_file(name + '.smb')
+
+        deadline = t0 + timeout if timeout is not None else None
+        result['reason'] = run_limited(vm, max_steps, deadline)
+        result['error'] = vm.error
+
+    except (OSError, LoadError) as e:
+        result['reason'] = 'load'
+        result['error'] = str(e)
+
+    except Exception as e:
+        result['reason'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+
+    result['steps'] = vm.steps
+    result['output'] = out.getvalue()
+    result['elapsed'] = time.perf_counter() - t0
+    return result
+
+# --------------------------------------------------------------
+# many programs
+
+def program_names(patterns: list[str]) -> list[str]:
+    """program names without extension from names and glob patterns"""
+
+    names = []
+    for pattern in patterns:
+        found = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for name in found:
+            if len(name) > 4 and name[-4] == '.':
+                name = name[:-4]
+            if name not in names:
+                names.append(name)
+    return names
+
+def run_batch(names: list[str], workers: int | None = None,
+              max_steps: int | None = None, timeout: float | None = None) -> list[dict]:
+    """run programs across a pool of worker processes, results in order of names"""
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(run_one, name, max_steps, timeout) for name in names]
+        return [f.result() for f in futures]
+
+def summary(results: list[dict]) -> str:
+    """results as a text table"""
+
+    lines = [f"{'program':20} {'reason':8} {'steps':>9} {'ms':>9}  output",
+             f"{'-' * 20} {'-' * 8} {'-' * 9} {'-' * 9}  {'-' * 30}"]
+    for r in results:
+        text = r['error'] if r['error'] else r['output'].strip().replace('\n', ' | ')
+        if len(text) > 40:
+            text = text[:37] + '...'
+        lines.append(f"{r['program']:20} {r['reason']:8} {r['steps']:9} "
+                     f"{r['elapsed'] * 1000:9.2f}  {text}")
+
+    reasons = {}
+    for r in results:
+        reasons[r['reason']] = reasons.get(r['reason'], 0) + 1
+    total = ", ".join(f"{k}: {v}" for k, v in sorted(reasons.items()))
+    lines.append(f"\n{len(results)} programs, {total}")
+    return "\n".join(lines)
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """run programs given by names or globs, print a summary"""
+
+    parser = argparse.ArgumentParser(description="Run many stack machine programs at once")
+    parser.add_argument('programs', nargs='+',
+                        help="program names or globs, e.g. 'progs/*.smb'")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument('--steps', type=int, default=None,
+                        help="stop each program after this many codes")
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="stop each program after this many seconds")
+    parser.add_argument('--json', default=None, metavar='FILE',
+                        help="write all results, with full output, to FILE")
+    args = parser.parse_args(argv)
+
+    names = program_names(args.programs)
+    if not names:
+        print("No programs found.")
+        raise SystemExit(1)
+
+    results = run_batch(names, args.workers, args.steps, args.timeout)
+    print(summary(results))
+
+    if args.json:
+        with open(args.json, 'wt') as jsonfile:
+            json.dump(results, jsonfile, indent=2)
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2025-06-07 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmbench, замеры скорости компилятора, интерпретатора и декомпилятора
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# setup
+
+# loop programs from progs/, compiled by ksmc if .smb is missing
+PROGS = ['progs/prog02', 'progs/prog03', 'progs/prog07', 'progs/prog09']
+
+REPEAT = 20         # runs per measurement of progs, best time is taken
+REPEAT_LOAD = 3     # runs per measurement of generated workloads
+
+MACRO_LINES = 5000  # most macro calls in one source, to fit in CFlen
+
+# command line tools timed for start up, with arguments to run a tiny program
+TOOLS = {'ksmc': ['-v', '0', '--no-cache'],
+         'ksmr': ['--output', 'file'],
+         'ksmd': ['--output', 'file']}
+TINY = 'progs/prog01'
+REPEAT_START = 10   # starts per tool, best time is taken
+
+# --------------------------------------------------------------
+# imports
+
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+import ksmlog
+import ksmr
+from ksmr import VM, Output
+
+# --------------------------------------------------------------
+# service functions
+
+def load_code(name: str) -> bytes:
+    """return byte code of program name, compile it first if needed"""
+
+    inname = name + '.smb'
+    if not os.path.exists(inname):
+        subprocess.run([sys.executable, 'ksmc.py', name],
+                       stdout=subprocess.DEVNULL, check=True)
+    with open(inname, 'rb') as infile:
+        return infile.read()
+
+def time_run(vm: VM, cf: bytes, repeat: int = REPEAT) -> tuple[float, int]:
+    """best time of repeat runs of cf on vm, and codes executed per run"""
+
+    best = float('inf')
+    for _ in range(repeat):
+        vm.load(cf)
+        t0 = time.perf_counter()
+        vm.run()
+        t1 = time.perf_counter()
+        best = min(best, t1 - t0)
+    return best, vm.steps
+
+def time_script(script: str, argv: list[str], repeat: int = REPEAT_LOAD) -> float:
+    """best time of repeat runs of script (ksmc.py, ksmd.py) in this process"""
+
+    best = float('inf')
+    saved = sys.argv
+    try:
+        for _ in range(repeat):
+            sys.argv = [script] + argv
+            ksmlog.setup()
+            with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):
+                t0 = time.perf_counter()
+                runpy.run_path(script, run_name='__main__')
+                t1 = time.perf_counter()
+            best = min(best, t1 - t0)
+    finally:
+        sys.argv = saved
+        ksmlog.setup()
+    return best
+
+# --------------------------------------------------------------
+# generated workloads, size grows with scale
+
+def gen_do_nest(scale: int) -> str:
+    """three do/loop nested, counter is dropped after each loop"""
+
+    return f"""; do/loop nest
+0
+{30 * scale} do
+    30 do
+        30 do
+            1 add
+        loop rsds drop
+    loop rsds drop
+loop rsds drop
+printnum
+end
+"""
+
+def gen_while(scale: int) -> str:
+    """long begin/while/repeat runs"""
+
+    return f"""; begin/while/repeat
+{3 * scale} do
+    30000 begin 1 sub dup while repeat drop
+loop rsds drop
+end
+"""
+
+def gen_recursion(scale: int) -> str:
+    """binary tree of calld/return, 2047 calls per tree"""
+
+    return f"""; calld/return recursion
+{10 * scale} do
+    10 calld tree
+loop rsds drop
+stop
+
+label tree
+    dup if
+        1 sub dup
+        calld tree
+        calld tree
+    else
+        drop
+    then
+    return
+
+end
+"""
+
+def gen_memory(scale: int) -> str:
+    """store to and fetch from all memory cells"""
+
+    top = ksmr.MEMSIZE - 1
+    return f"""; memory sweeps
+{5 * scale} do
+    {top} begin dup dup store 1 sub dup while repeat drop
+    {top} begin dup fetch drop 1 sub dup while repeat drop
+loop rsds drop
+end
+"""
+
+def gen_macros(scale: int) -> str:
+    """many macro calls with parameters, for the compiler mostly"""
+
+    lines = ["; macro calls",
+             "macro _acc", "$0 $1 add $2 mul drop", "",
+             "macro _out", "$0 printnum", ""]
+    for i in range(min(1000 * scale, MACRO_LINES)):
+        lines.append(f"_acc {i % 1000} {i % 7} {i % 13}")
+        if i % 100 == 0:
+            lines.append(f"_out {i}")
+    lines += ["println", "end", ""]
+    return "\n".join(lines)
+
+WORKLOADS = {
+    'do_nest':   gen_do_nest,
+    'while':     gen_while,
+    'recursion': gen_recursion,
+    'memory':    gen_memory,
+    'macros':    gen_macros,
+}
+
+# --------------------------------------------------------------
+# compare traced and plain runs
+
+def bench_progs() -> list[dict]:
+    """time every program of PROGS with and without --trace"""
+
+    # traced runs log as the command line does, into a .sml file
+    logname = os.path.join(tempfile.mkdtemp(), 'bench.sml')
+    ksmlog.setup((logname, 'DEBUG'))
+
+    # program output is dropped
+    plain = VM(Output(stdout=False))
+    traced = VM(Output(stdout=False), trace=True)
+
+    print(f"{'program':14} {'codes':>6} {'trace, ms':>10} {'plain, ms':>10} {'codes/s':>10} {'speedup':>8}")
+    print(f"{'-' * 14} {'-' * 6} {'-' * 10} {'-' * 10} {'-' * 10} {'-' * 8}")
+
+    results = []
+    for name in PROGS:
+        cf = load_code(name)
+        t_trace, steps = time_run(traced, cf)
+        t_plain, steps = time_run(plain, cf)
+        print(f"{name:14} {steps:6} {t_trace * 1000:10.3f} {t_plain * 1000:10.3f} "
+              f"{steps / t_plain:10.0f} {t_trace / t_plain:7.1f}x")
+        results.append({'program': name, 'codes': steps,
+                        'trace_s': t_trace, 'plain_s': t_plain})
+
+    ksmlog.setup()
+    os.remove(logname)
+    return results
+
+# --------------------------------------------------------------
+# compile, run and decompile generated workloads
+
+def bench_workloads(scale: int, optlev: int, repeat: int) -> list[dict]:
+    """time ksmc, ksmr and ksmd on every workload of WORKLOADS"""
+
+    workdir = tempfile.mkdtemp()
+    vm = VM(Output(stdout=False))
+
+    print(f"\n{'workload':10} {'lines':>6} {'bytes':>6} {'codes':>9} "
+          f"{'ksmc lines/s':>13} {'ksmr codes/s':>13} {'ksmd bytes/s':>13}")
+    print(f"{'-' * 10} {'-' * 6} {'-' * 6} {'-' * 9} {'-' * 13} {'-' * 13} {'-' * 13}")
+
+    results = []
+    for name, gen in WORKLOADS.items():
+        path = os.path.join(workdir, name)
+        source = gen(scale)
+        with open(path + '.smt', 'wt') as smtfile:
+            smtfile.write(source)
+        lines = source.count('\n')
+
+        t_ksmc = time_script('ksmc.py', [path, '-O', str(optlev), '--no-cache', '-v', '0'], repeat)
+        with open(path + '.smb', 'rb') as smbfile:
+            cf = smbfile.read()
+        t_ksmr, steps = time_run(vm, cf, repeat)
+        if vm.state != 'stopped':
+            raise SystemExit(f"Workload {name} did not stop: {vm.state}, {vm.error}")
+        t_ksmd = time_script('ksmd.py', [path], repeat)
+
+        print(f"{name:10} {lines:6} {len(cf):6} {steps:9} "
+              f"{lines / t_ksmc:13.0f} {steps / t_ksmr:13.0f} {len(cf) / t_ksmd:13.0f}")
+        results.append({'workload': name, 'lines': lines, 'bytes': len(cf), 'codes': steps,
+                        'ksmc_s': t_ksmc, 'ksmr_s': t_ksmr, 'ksmd_s': t_ksmd,
+                        'ksmc_lines_per_s': lines / t_ksmc,
+                        'ksmr_codes_per_s': steps / t_ksmr,
+                        'ksmd_bytes_per_s': len(cf) / t_ksmd})
+    return results
+
+# --------------------------------------------------------------
+# start up time of the command line tools
+
+def import_times(module: str) -> tuple[float, list[tuple[str, float]], bool]:
+    """import module in a new python with -X importtime: its time, s,
+    the modules it imports itself with their times, heaviest first,
+    and if loguru was imported
+    """
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, check=True)
+
+    total = 0.0
+    parts = []
+    loguru = False
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip(' '))
+        name = name.strip()
+        loguru = loguru or name == 'loguru'
+        if depth == 1:
+            if name == module:
+                total = int(cumulative) / 1e6
+                break
+            parts = []
+        elif depth == 3:
+            parts.append((name, int(cumulative) / 1e6))
+
+    parts.sort(key=lambda part: -part[1])
+    return total, parts, loguru
+
+def time_start(argv: list[str], repeat: int = REPEAT_START) -> float:
+    """best wall time of repeat runs of python with argv, in new processes"""
+
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable] + argv, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench_startup(repeat: int = REPEAT_START) -> list[dict]:
+    """time imports and whole runs of TOOLS on the tiny program TINY,
+    against python that does nothing
+    """
+
+    # the tools write next to the program, so they get a copy of it
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, os.path.basename(TINY))
+    with open(TINY + '.smt', 'rt') as infile, open(path + '.smt', 'wt') as outfile:
+        outfile.write(infile.read())
+    subprocess.run([sys.executable, 'ksmc.py', path, '-v', '0', '--no-cache'],
+                   stdout=subprocess.DEVNULL, check=True)
+
+    t_bare = time_start(['-c', 'pass'], repeat)
+
+    print(f"\n{'tool':6} {'import, ms':>10} {'run, ms':>8} {'- python':>9} {'loguru':>6}  heaviest imports")
+    print(f"{'-' * 6} {'-' * 10} {'-' * 8} {'-' * 9} {'-' * 6}  {'-' * 30}")
+
+    results = []
+    for tool, argv in TOOLS.items():
+        t_import, parts, loguru = min(import_times(tool) for _ in range(repeat))
+        t_run = time_start([tool + '.py', path] + argv, repeat)
+        heavy = ", ".join(f"{name} {t * 1000:.1f}" for name, t in parts[:3])
+        print(f"{tool:6} {t_import * 1000:10.1f} {t_run * 1000:8.1f} "
+              f"{(t_run - t_bare) * 1000:9.1f} {'yes' if loguru else 'no':>6}  {heavy}")
+        results.append({'tool': tool, 'import_s': t_import, 'run_s': t_run,
+                        'python_s': t_bare, 'loguru': loguru,
+                        'imports': dict(parts)})
+    print(f"{'python':6} {'':10} {t_bare * 1000:8.1f}")
+    return results
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """run the benchmarks, print tables, optionally save results as json"""
+
+    parser = argparse.ArgumentParser(description="Stack machine benchmarks")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="size of generated workloads (default 1)")
+    parser.add_argument('-O', dest='optlev', type=int, default=0, metavar='LEVEL',
+                        help="ksmc optimization level for workloads")
+    parser.add_argument('--repeat', type=int, default=REPEAT_LOAD,
+                        help="runs per workload measurement, best time is taken")
+    parser.add_argument('--json', default=None, metavar='FILE',
+                        help="write results to FILE, to compare versions")
+    parser.add_argument('--no-progs', dest='progs', action='store_false',
+                        help="skip traced/plain runs of progs/")
+    parser.add_argument('--no-startup', dest='startup', action='store_false',
+                        help="skip start up times of the command line tools")
+    parser.add_argument('--startup-max', type=float, default=None, metavar='MS',
+                        help="fail if a tool takes longer than MS to import, "
+                             "or imports loguru when it has nothing to log")
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': ksmr.version,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'optlev': args.optlev,
+        'progs': bench_progs() if args.progs else [],
+        'workloads': bench_workloads(args.scale, args.optlev, args.repeat),
+        'startup': bench_startup() if args.startup else [],
+    }
+
+    if args.json:
+        with open(args.json, 'wt') as jsonfile:
+            json.dump(results, jsonfile, indent=2)
+        print(f"\nResults written to {args.json}.")
+
+    if args.startup_max is not None:
+        slow = [r['tool'] for r in results['startup']
+                if r['loguru'] or r['import_s'] * 1000 > args.startup_max]
+        if slow:
+            raise SystemExit(f"\nStart up too slow: {', '.join(slow)}")
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
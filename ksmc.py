@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # Mikhail (myke) Kolodin
-# 2025-05-27 2025-06-06 1.0.8
+# 2025-05-27 2026-10-17 1.0.8
 
 # --------------------------------------------------------------
 # Стековая машина - Stack machine
@@ -15,33 +15,29 @@ version = '11'
 # --------------------------------------------------------------
 # imports
 
+import os
 import sys
-from loguru import logger
-from pprint import pp, pprint
+import time
+import argparse
 from collections import defaultdict
 
-# --------------------------------------------------------------
-# in/out file names
-
-print(f"{sys.argv=}")
-
-if len(sys.argv) > 1:
-    inout = sys.argv[1]
-else:
-    inout = 'prog01'
+import ksmop
+from ksmop import LENGTHS, name2code, SHORT, SHORT_CODES, ADDR_BYTES, CF_MAX, FORMATS, LENGTHS_BY_FORMAT
+from ksmop import SECTIONED
+import ksmobj
+from ksmlog import logger, CHOICES
+import ksmlog
 
-if len(inout) > 4 and inout[-4] == '.':
-    inout = inout[:-4]
+# how much ksmc tells about its work
+VERBOSE_SILENT  = 0     # nothing
+VERBOSE_SUMMARY = 1     # results and errors
+VERBOSE_LINES   = 2     # also every line of source
+VERBOSE_WORDS   = 3     # also every word of source, slow
 
-inname  = inout + '.smt'     # state machine program text
-outname = inout + '.smb'     # state machine program binary
-logname = inout + '.sml'     # state machine log file
-
-logger.remove()
-logger.add(logname)
-
-print(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
-logger.info(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
+# compiled code cache: directory and size limit, bytes
+CACHE_DIR  = os.path.join(os.path.expanduser('~'), '.cache', 'ksm')
+CACHE_SIZE = 64 * 1024 * 1024
+CACHE_REV  = 2      # one more when the same source compiles to other code
 
 HEADLEN = 4                  # length of code file header
 
@@ -56,9 +52,20 @@ CODE_JUMP    = 30
 CODE_DSRS    = 10
 CODE_RSDS    = 11
 CODE_DUP     = 12
+CODE_DROP    = 13
+CODE_SWAP    = 16
+CODE_ADD     = 21
 CODE_SUB     = 22
+CODE_MUL     = 23
+CODE_JOF     = 37
+CODE_CALLD   = 40
+CODE_CALLI   = 41
+CODE_RETURN  = 42
 CODE_BYTE    = 73
 CODE_NUMBER  = 74
+CODE_ADDR    = 75
+CODE_JRZ     = 80
+CODE_DJNZ    = 81
 
 # limits
 
@@ -68,508 +75,1230 @@ Memlen  =  1024     # memory
 CFlen   = 65535     # code file 
 CSlen   =   255     # control structures nesting
 
-# --------------------------------------------------------------
-# get data about machine codes
-
-codes = []
-
-## normal version, with tabs, checked + corrected
-codesname = 'opcodes.tsv'
-with open(codesname, 'rt') as codesfile:
-    line = codesfile.readline()
-    for line in codesfile.readlines():
-        c, n, b, d = line.strip().split('\t', maxsplit=3)
-        c = int(c)
-        b = int(b)
-        codes.append((c, n, b, d))
-# pprint(codes)
-
-name2code = {}
-for c, n, b, d in codes:
-    name2code[n] = {'code': c, 'name': n, 'bytes': b, 'description': d}
-# pprint(name2code)
-
 # pseudocommands (macros etc) (TBD)
 pseudos = "label if then else do loop begin while repeat macro name const version model" . split()
 
-# code memory
-cf = bytearray()
+class EOP (Exception): pass
 
-# labels defines: name -> addr
-labset = {}
-# labels references: addr -> name
-labref = {}
+# --------------------------------------------------------------
+# optimizer
+#
+# Works on a list of instructions (code, arg) made from cf before
+# labels are fixed up. arg is None, a number, a label name (str)
+# or the text of a string (bytes). A label definition is (LABEL, name).
+
+LABEL = -1
+
+# codes with a label operand
+CODES_REF = {30, 31, 32, 33, 34, 35, 36, 37, 38, CODE_CALLD, CODE_ADDR, CODE_JRZ, CODE_DJNZ}
+
+# conditional jumps that pop DS0
+CODES_JCOND = {31, 32, 33, 34, 35, 36}
+
+# codes after which control never falls through
+CODES_NOFALL = {CODE_STOP, CODE_END, CODE_JUMP, CODE_RETURN}
+
+# codes that set flag 'overflow' anew: add sub mul div mod djnz
+CODES_OVERFLOW = {21, 22, 23, 24, 25, CODE_DJNZ}
+
+def lift(cf: bytearray, labset: dict, labref: dict, lengths: bytes = LENGTHS) -> list:
+    """make list of instructions from code file cf, lengths of codes are of its format"""
+
+    at = defaultdict(list)          # address -> label names
+    for name, a in labset.items():
+        at[a].append(name)
+
+    prog = []
+    icode = HEADLEN
+    while icode < len(cf):
+        for name in at.pop(icode, []):
+            prog.append((LABEL, name))
+        code = cf[icode]
+        oplen = lengths[code]
+        match oplen:
+            case _ if icode+1 in labref:
+                arg = labref[icode+1]
+            case 2:
+                arg = cf[icode+1]
+            case 3:
+                x1 = cf[icode+1]
+                x2 = cf[icode+2]
+                if code == CODE_NUMBER:
+                    s = x1 & 128
+                    x1 &= 127
+                    arg = x1 * 256 + x2
+                    arg *= -1 if s else 1
+                else:
+                    arg = x1 * 256 + x2
+            case _ if code == CODE_STRING:
+                arg = bytes(cf[icode+2:icode+2+cf[icode+1]])
+                oplen += len(arg) + 1
+            case _:
+                arg = None
+        prog.append((code, arg))
+        icode += oplen
+
+    for a in sorted(at):
+        for name in at[a]:
+            prog.append((LABEL, name))
+
+    return prog
+
+def size(prog: list, lengths: bytes = LENGTHS) -> tuple[int, int]:
+    """number of instructions and bytes in prog, all jumps long"""
+
+    count = 0
+    nbytes = 0
+    for code, arg in prog:
+        if code == LABEL:
+            continue
+        count += 1
+        nbytes += lengths[code]
+        if code == CODE_STRING:
+            nbytes += len(arg) + 1
+    return count, nbytes
+
+def literal(ins: tuple) -> int | None:
+    """number put on DS by instruction ins, if it is a literal"""
+
+    code, arg = ins
+    if code == CODE_BYTE or code == CODE_NUMBER:
+        return arg
+    return None
+
+def make_literal(x: int) -> tuple | None:
+    """shortest literal instruction for x, None if x does not fit"""
+
+    if 0 <= x <= 255:
+        return (CODE_BYTE, x)
+    if -32767 <= x <= 32767:
+        return (CODE_NUMBER, x)
+    return None
+
+def overflow_unseen(prog: list, i: int) -> bool:
+    """flag 'overflow' set before prog[i] is set anew before any jof
+    (long or short) can test it; looks no further than its block of code
+    """
+
+    for j in range(i, len(prog)):
+        code = prog[j][0]
+        if code in CODES_OVERFLOW:
+            return True
+        if code == CODE_JOF or code == LABEL or code == CODE_CALLI \
+                or code in CODES_REF or code in CODES_NOFALL:
+            return False
+    return False
+
+def thread_jumps(prog: list) -> bool:
+    """send jumps that land on another jump to its target, True if any"""
+
+    # label -> target of the jump right after it
+    hop = {}
+    for i, (code, arg) in enumerate(prog):
+        if code != LABEL:
+            continue
+        j = i + 1
+        while j < len(prog) and prog[j][0] == LABEL:
+            j += 1
+        if j < len(prog) and prog[j][0] == CODE_JUMP:
+            hop[arg] = prog[j][1]
+
+    changed = False
+    for i, (code, arg) in enumerate(prog):
+        if code not in CODES_REF or code == CODE_ADDR or arg not in hop:
+            continue
+        seen = {arg}
+        target = arg
+        while target in hop and hop[target] not in seen:
+            target = hop[target]
+            seen.add(target)
+        if target != arg:
+            prog[i] = (code, target)
+            changed = True
+
+    return changed
+
+def peephole(prog: list, optlev: int) -> bool:
+    """one pass of local changes over prog in place, True if any"""
+
+    changed = False
+    i = 0
+    while i < len(prog):
+        code, arg = prog[i]
+        nxt = prog[i+1][0] if i+1 < len(prog) else None
+
+        # swap swap, dup drop: nothing
+        if (code, nxt) in ((CODE_SWAP, CODE_SWAP), (CODE_DUP, CODE_DROP)):
+            del prog[i:i+2]
+            changed = True
+            continue
+
+        # jump to the next instruction: nothing, or drop for a test of DS0
+        if code == CODE_JUMP or code in CODES_JCOND:
+            j = i + 1
+            while j < len(prog) and prog[j][0] == LABEL and prog[j][1] != arg:
+                j += 1
+            if j < len(prog) and prog[j] == (LABEL, arg):
+                if code == CODE_JUMP:
+                    del prog[i]
+                else:
+                    prog[i] = (CODE_DROP, None)
+                changed = True
+                continue
 
-# make header
-cf.extend(('SM' + version).encode('ascii'))
+        # literal literal add/sub/mul: literal, when no jof sees the flag it set
+        if optlev >= 2 and i+2 < len(prog):
+            x1 = literal(prog[i])
+            x2 = literal(prog[i+1])
+            op = prog[i+2][0]
+            if x1 is not None and x2 is not None and op in (CODE_ADD, CODE_SUB, CODE_MUL) \
+                    and overflow_unseen(prog, i+3):
+                if op == CODE_ADD:
+                    x = (x1 + x2) % 65636
+                elif op == CODE_SUB:
+                    x = (x1 - x2) % 65636
+                else:
+                    x = (x1 * x2) % 65636
+                ins = make_literal(x)
+                if ins is not None:
+                    prog[i:i+3] = [ins]
+                    changed = True
+                    continue
 
-# make contents: program code
+        i += 1
+
+    return changed
+
+def drop_dead(prog: list) -> bool:
+    """remove code after jump, stop, end, return up to a used label, True if any"""
+
+    used = {arg for code, arg in prog if code in CODES_REF}
+
+    changed = False
+    i = 0
+    while i < len(prog):
+        if prog[i][0] in CODES_NOFALL:
+            j = i + 1
+            while j < len(prog) and not (prog[j][0] == LABEL and prog[j][1] in used):
+                j += 1
+            dead = [ins for ins in prog[i+1:j] if ins[0] != LABEL]
+            if dead:
+                prog[i+1:j] = [ins for ins in prog[i+1:j] if ins[0] == LABEL]
+                changed = True
+        i += 1
+
+    return changed
+
+def optimize(prog: list, optlev: int) -> list:
+    """optimize prog at level optlev, repeat while anything changes"""
+
+    prog = list(prog)
+    changed = True
+    while changed:
+        changed = thread_jumps(prog)
+        changed |= peephole(prog, optlev)
+        if optlev >= 2:
+            changed |= drop_dead(prog)
+    return prog
+
+def relax(prog: list, fmt: str) -> tuple[set, dict]:
+    """jumps and calls of prog (indexes) that reach their labels with short forms
+    in format fmt, and addresses of labels then; begins with all short and makes
+    long those that do not reach, until all left reach
+    """
+
+    lengths = LENGTHS_BY_FORMAT[fmt]
+    inline = fmt not in SECTIONED
+
+    names = {arg for code, arg in prog if code == LABEL}
+    short = {i for i, (code, arg) in enumerate(prog)
+             if code + SHORT in SHORT_CODES and arg in names}
+
+    while True:
+        a = HEADLEN if inline else 0
+        at = []
+        labpos = {}
+        for i, (code, arg) in enumerate(prog):
+            at.append(a)
+            if code == LABEL:
+                labpos[arg] = a
+            elif i in short:
+                a += 2
+            elif code == CODE_STRING and inline:
+                a += 2 + len(arg)
+            else:
+                a += lengths[code]
+
+        far = {i for i in short if not -128 <= labpos[prog[i][1]] - (at[i] + 2) <= 127}
+        if not far:
+            return short, labpos
+        short -= far
+
+def assemble(prog: list, fmt: str = version,
+             short: bool = True) -> tuple[bytearray, dict, dict, bytearray]:
+    """make code file of format fmt from list of instructions, labels are not fixed yet;
+    with short, jumps and calls to near labels take short forms (formats 12, 13);
+    in format 13 make code section and string pool, equal strings are pooled once
+    """
+
+    lengths = LENGTHS_BY_FORMAT[fmt]
+    width = ADDR_BYTES[fmt]
+    inline = fmt not in SECTIONED
+    short, labpos = relax(prog, fmt) if short and fmt != '11' else (set(), {})
+
+    cf = bytearray(('SM' + fmt).encode('ascii')) if inline else bytearray()
+    labset = {}
+    labref = {}
+    pool = bytearray()
+    pooled = {}                 # string -> offset in pool
+
+    for i, (code, arg) in enumerate(prog):
+        if code == LABEL:
+            labset[arg] = len(cf)
+            continue
+        if i in short:
+            # from the next code, which is 2 bytes after this one
+            cf.append(code + SHORT)
+            cf.append((labpos[arg] - len(cf) - 1) % 256)
+            continue
+        cf.append(code)
+        if code == CODE_STRING and not inline:
+            if arg not in pooled:
+                pooled[arg] = len(pool)
+                pool.append(len(arg))
+                pool.extend(arg)
+            cf.extend(pooled[arg].to_bytes(width))
+        elif code == CODE_STRING:
+            cf.append(len(arg))
+            cf.extend(arg)
+        elif code in CODES_REF:
+            labref[len(cf)] = arg
+            cf.extend(bytes(width))
+        elif code == CODE_NUMBER:
+            s = 0 if arg >= 0 else 128
+            x = abs(arg)
+            cf.append( s | x // 256 )
+            cf.append( x % 256 )
+        elif lengths[code] == 2:
+            cf.append(arg)
+        elif lengths[code] == 3:
+            cf.append(arg // 256)
+            cf.append(arg % 256)
+
+    return cf, labset, labref, pool
 
-# compiler state
-state = "normal"
-# others: "getlabel", "setlabel", "getbyte", "getnumber", "getstring", "getchar", "macrodef"
+# --------------------------------------------------------------
+# the compiler
+
+class Compiler:
+    """compiler of program text into byte code, works in memory
+
+    One instance can compile any number of programs in turn.
+    After compile() the results of the last program are kept:
+    cf (byte code), labset (label -> address), labref (address -> label),
+    macros, consts, lines (number of lines read) and diagnostics,
+    a list of dicts: {'level': 'error' or 'warning', 'line', 'word', 'message'}.
+
+    Progress is printed and logged as much as verbose tells
+    (VERBOSE_SILENT ... VERBOSE_WORDS); silent by default.
+
+    fmt is the code file format, '11', '12' or '13' (see ksmop.FORMATS):
+    format 12 has 3 byte addresses and, with optimization, short jumps;
+    format 13 is format 12 in sections, with a string pool, labels
+    and CRC32 (see ksmobj). Code is compiled as for format 12, then
+    laid out anew with strings moved to the pool.
+
+    With a cache, compile() looks for the source there first
+    and puts new error free results there.
+
+    In stream mode each label operand is filled in as soon as its label
+    is known: a forward reference keeps in its operand the address of the
+    previous reference to the same label, and defining the label walks
+    this chain. So labref is not kept, and the optimizer passes
+    (which need the whole program) are skipped; -O1 still gives fused codes.
+    """
+
+    def __init__(self, optlev: int = 0, verbose: int = VERBOSE_SILENT,
+                 cache: 'CompileCache | None' = None, stream: bool = False,
+                 fmt: str = version):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown code file format: {fmt}")
+        if stream and fmt in SECTIONED:
+            raise ValueError(f"stream mode does not write code file format {fmt}")
+        self.optlev = optlev     # optimization level, see optimize()
+        self.fmt = fmt           # code file format
+        self.verbose = verbose   # how much to print and log, VERBOSE_...
+        self.cache = cache       # compiled code cache, or None
+        self.stream = stream     # fix up labels on the fly, no optimizer passes
+        self.reset()
+
+    def reset(self) -> None:
+        """forget the last program"""
+
+        self.cf = b''
+        self.labset = {}
+        self.labref = {}
+        self.macros = {}
+        self.consts = {}
+        self.lines = 0
+        self.saved = (0, 0)      # bytes and instructions saved by optimizer
+        self.diagnostics = []
+        self.cached = False      # last result came from cache
+
+    @property
+    def errors(self) -> list[dict]:
+        """diagnostics of level error"""
+
+        return [d for d in self.diagnostics if d['level'] == 'error']
+
+    # ----------------------------------------------------------
+    # messages
+
+    def say(self, text: str) -> None:
+        """progress message, printed and logged; callers check verbose first,
+        so that messages not shown are not even formatted
+        """
+
+        print(text)
+        logger.info(text)
+
+    def diag(self, level: str, text: str, line: int | None = None, word: str | None = None) -> None:
+        """add diagnostic of level 'error' or 'warning' about word in line"""
+
+        self.diagnostics.append({'level': level, 'line': line, 'word': word, 'message': text})
+        if self.verbose >= VERBOSE_SUMMARY:
+            where = f" (line {line})" if line else ""
+            print(f"{level.capitalize()}: {text}{where}")
+            logger.log(level.upper(), f"{text}{where}")
+
+    # ----------------------------------------------------------
+    # compile
+
+    def compile(self, source: str) -> bytes:
+        """compile program text source, return byte code"""
+
+        if self.cache is None or self.stream:
+            return self.compile_lines(source.splitlines())
+
+        key = self.cache.key(source, self.optlev, self.fmt)
+        hit = self.cache.get(key)
+        if hit is not None:
+            self.reset()
+            self.cf, info = hit
+            self.labset = info['labset']
+            self.labref = {int(k): v for k, v in info['labref'].items()}
+            self.macros = info['macros']
+            self.consts = info['consts']
+            self.lines = info['lines']
+            self.saved = tuple(info['saved'])
+            self.diagnostics = info['diagnostics']
+            self.cached = True
+            if self.verbose >= VERBOSE_SUMMARY:
+                self.say(f"Cache hit: {key}")
+            return self.cf
+
+        cf = self.compile_lines(source.splitlines())
+        if not self.errors:
+            self.cache.put(key, cf, {
+                'labset': self.labset, 'labref': self.labref,
+                'macros': self.macros, 'consts': self.consts,
+                'lines': self.lines, 'saved': self.saved,
+                'diagnostics': self.diagnostics})
+        return cf
+
+    def compile_lines(self, lines) -> bytes:
+        """compile program text given as lines (any iterable, e.g. an open file),
+        return byte code
+        """
+
+        self.reset()
+        optlev = self.optlev
+        fmt = self.fmt
+        inline = fmt not in SECTIONED  # strings in code, not in the pool
+        image = fmt if inline else '12'   # format of code while compiling
+        width = ADDR_BYTES[fmt]        # bytes of address operands
+        cfmax = CF_MAX[fmt]
+        say = self.say
+        diag = self.diag
+        summary = self.verbose >= VERBOSE_SUMMARY
+        perline = self.verbose >= VERBOSE_LINES
+        perword = self.verbose >= VERBOSE_WORDS
+
+        # code memory
+        cf = bytearray()
+
+        # labels defines: name -> addr
+        labset = {}
+        # labels references: addr -> name
+        labref = {}
+
+        # make header
+        cf.extend(('SM' + fmt).encode('ascii'))
+
+        # make contents: program code
+
+        # compiler state
+        state = "normal"
+        # others: "getlabel", "setlabel", "getbyte", "getnumber", "getstring", "getchar", "macrodef"
+
+        # control structures
+        ctrlstr = []
+        ctrllev = []
+        ctrlnum = 0
+
+        # macros
+        macros = defaultdict(str)
+
+        # consts
+        consts = {}
+
+        # labels used: name -> first line using it, for messages
+        reflines = {}
+
+        # code grew over cfmax, told once; addresses may not fit operands
+        toolong = False
+
+        def too_long(line=None):
+            """code is longer than the format allows: tell once, stop"""
+            nonlocal toolong
+            if not toolong:
+                toolong = True
+                diag('error', f"Code too long: {len(cf)} bytes", line)
+            raise EOP
+
+        if self.stream:
+
+            # label -> address of its last forward reference, the head of a chain
+            pending = {}
+
+            def refer(name):
+                """operand for label name: its address, or a link in its chain"""
+                reflines.setdefault(name, iline)
+                if len(cf) > cfmax:
+                    too_long(iline)
+                x = labset[name] if name in labset else pending.get(name, 0)
+                if name not in labset:
+                    pending[name] = len(cf)
+                cf.extend(x.to_bytes(width))
+
+            def define(name):
+                """label name is here: fill in all operands waiting for it"""
+                a = len(cf)
+                if a > cfmax:
+                    too_long(iline)
+                labset[name] = a
+                link = pending.pop(name, 0)
+                while link:
+                    nxt = int.from_bytes(cf[link:link+width])
+                    cf[link:link+width] = a.to_bytes(width)
+                    link = nxt
+
+        else:
+
+            def refer(name):
+                """operand for label name, filled in after compiling"""
+                reflines.setdefault(name, iline)
+                labref[len(cf)] = name
+                cf.extend(bytes(width))
+
+            def define(name):
+                """label name is here"""
+                labset[name] = len(cf)
+
+        iline = 0
+        word = None
+
+        try:
+
+            # main loop
+            for iline, line in enumerate(lines, 1):
+
+                if len(cf) > cfmax:
+                    too_long(iline)
+
+                line = line.strip()
+
+                if perline:
+                    say(f"{iline} {line}")
+
+                # check for macro call
+                if line.startswith('_'):
+                    macroname, *params = line.split()
+                    if macroname not in macros:
+                        diag('error', f"unknown macro: {macroname}", iline, macroname)
+                        raise EOP
+                    line = macros[macroname]
+
+                    for i in range(len(params)):
+                        str_from = "$"+str(i)
+                        str_to = params[i]
+                        line = line.replace(str_from, str_to)
+                        if perline:
+                            say(f"replace({str_from=}, {str_to=})")
+
+                    if perline:
+                        say(f"{line=}")
+
+                # check for macro call
+                elif line.startswith('macro'):
+                    macroname = line.split()[1]
+                    if macroname in macros:
+                        diag('error', f"duplicate macro name: {macroname}", iline, macroname)
+                        raise EOP
+                    # ok
+                    state = 'macrodef'
+                    continue
 
-class EOP (Exception): pass
+                elif state == 'macrodef':
+                    if len(line):
+                        macros[macroname] += " " + line
+                    else:
+                        state = 'normal'
+                        if perline:
+                            say(f"macro def '{macroname}': {macros[macroname]}")
+                    continue
+                # end of macro checks
 
-# control structures
-ctrlstr = []
-ctrllev = []
-ctrlnum = 0
+                for iword, word in enumerate(line.split(), 1):
 
-# macros
-macros = defaultdict(str)
+                    if perword:
+                        say(f"\t {iword} {word}")
 
-# consts
-consts = {}
+                    # comments
+                    if word == '#' or word == ';':
+                        if perword:
+                            say("comment")
+                        break
 
-# error state on command loop
-isError = True
+                    # commands
+                    if perword:
+                        say(f"{state=}, {word=}, {len(cf)=}")
 
-# --------------------------------------------------------------
-# check functions
+                    # chars
+                    if word.startswith("'") and word.endswith("'"):
+                        cf.append(CODE_CHAR)
+                        cf.append( ord(word.strip("'")) )
+                        continue
 
-def check_cf():
-    """check code file length"""
-    
-    assert len(cf) <= CFlen
+                    # strings
+                    if word.startswith('"') and word.endswith('"'):
+                        cf.append(CODE_STRING)
+                        word = word.strip('\"')
+                        cf.append( len(word) )
+                        for ch in word:
+                            cf.append( ord(ch) )
+                        continue
 
-# --------------------------------------------------------------
-# read file with program, write byte code
+                    # general processing
 
-# process files
-with open(inname, 'rt') as inf:
-    
-    try:
-    
-        # main loop
-        for iline, line in enumerate(inf, 1):
-            
-            isError = False
-            check_cf()
-            
-            line = line.strip()
-            
-            print(iline, line)
-            logger.info(f"{iline=}: {line.strip()}")
-            
-            # check for macro call
-            if line.startswith('_'):
-                macroname, *params = line.split()
-                line = macros[macroname]
-                
-                for i in range(len(params)):
-                    str_from = "$"+str(i)
-                    str_to = params[i]
-                    line = line.replace(str_from, str_to)
-                    print(f"replace({str_from=}, {str_to=})")
-                    
-                print(f"{line=}")
-                logger.info(f"{line=}")
-            
-            # check for macro call
-            elif line.startswith('macro'):
-                macroname = line.split()[1]
-                if macroname in macros:
-                    print(f"Error: duplicate macro name: {macroname}")
-                    logger.error(f"Error: duplicate macro name: {macroname}")
-                    raise EOP
-                # ok
-                state = 'macrodef'
-                continue
-                
-            elif state == 'macrodef':
-                if len(line):
-                    macros[macroname] += " " + line
-                else:
-                    state = 'normal'
-                    print(f"macro def '{macroname}': {macros[macroname]}")
-                    logger.info(f"macro def '{macroname}': {macros[macroname]}")
-                continue
-            # end of macro checks
-            
-            for iword, word in enumerate(line.split(), 1):
-                
-                print("\t", iword, word, end=" ")
-                logger.info(f"{iword=}, {word=}")
-                
-                # comments
-                if word == '#' or word == ';':
-                    print("comment")
-                    logger.info("comment")
-                    break
-                
-                # commands
-                print(f"{state=}, {word=}, {len(cf)=}")
-                logger.info(f"{state=}, {word=}, {len(cf)=}")
-
-                # chars
-                if word.startswith("'") and word.endswith("'"):
-                    cf.append(CODE_CHAR)
-                    cf.append( ord(word.strip("'")) )
-                    continue
-                
-                # strings
-                if word.startswith('"') and word.endswith('"'):
-                    cf.append(CODE_STRING)
-                    word = word.strip('\"')
-                    cf.append( len(word) )
-                    for ch in word:
-                        cf.append( ord(ch) )
-                    continue
+                    match state:
 
-                # general processing
-                
-                match state:
-                    
-                    case 'normal':
-
-                        if word in consts:
-                            x = consts[word]
-                            if 0 <= x <= 255:
-                                cf.append(CODE_BYTE)
-                                cf.append( x )
-                                print(f"Added byte {x} as const {const_name} for word {word}")
-                                logger.info(f"Added byte {x} as const {const_name} for word {word}")
-                            else:
-                                s = 0 if x >= 0 else 128
-                                x = abs(x)
-                                x1 = x // 256
-                                x2 = x % 256
-                                cf.append(CODE_NUMBER)
-                                cf.append( s | x1 )
-                                cf.append( x2 )
-                                print(f"Added number {x} as const {const_name} for word {word}")
-                                logger.info(f"Added number {x} as const {const_name} for word {word}")
-                            state = 'normal'
-                            continue       
-
-                        if word in pseudos:
-                            print(f": pseudo '{word}' detected...")
-                            logger.info(f": pseudo '{word}' detected...")
-
-                            match word:
-                                
-                                case 'label':
-                                    state = 'deflabel'
-                                    # print('state = deflabel!')
-
-                                case 'const':
-                                    state = 'defconst1'
-                                    # print('state = defconst!')
-                                    
-                                case 'if':
-                                    ctrlnum += 1
-                                    ctrllev.append(ctrlnum)
-                                    ctrlstr.append('if')
-                                    cf.append(CODE_JEQ)
-                                    labref[len(cf)] = f'if_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    
-                                case 'else':
-                                    if ctrlstr[-1] != 'if':
-                                        logger.error(f"else outside if")
-                                        raise EOP
-                                    ctrlstr[-1] = 'ifelse'
-                                    cf.append(CODE_JUMP)
-                                    labref[len(cf)] = f'else_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    labset[f'if_{ctrllev[-1]}'] = len(cf)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    
-                                case 'then':
-                                    if ctrlstr[-1] == 'if':
-                                        labset[f'if_{ctrllev[-1]}'] = len(cf)
-                                    elif ctrlstr[-1] == 'ifelse':
-                                        labset[f'else_{ctrllev[-1]}'] = len(cf)
-                                    else:
-                                        logger.error(f"then outside if")
-                                        raise EOP
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    ctrlstr.pop()
-                                    ctrllev.pop()
-                                
-                                case 'begin':
-                                    ctrlnum += 1
-                                    ctrllev.append(ctrlnum)
-                                    ctrlstr.append('begin')
-                                    labset[f'begin_{ctrllev[-1]}'] = len(cf)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    
-                                case 'while':
-                                    if ctrlstr[-1] != 'begin':
-                                        logger.error(f"while outside begin")
-                                        raise EOP
-                                    cf.append(CODE_JEQ)
-                                    labref[len(cf)] = f'repeat_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    
-                                case 'repeat':
-                                    if ctrlstr[-1] != 'begin':
-                                        logger.error(f"repeat outside begin")
-                                        raise EOP
-                                    cf.append(CODE_JUMP)
-                                    labref[len(cf)] = f'begin_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    labset[f'repeat_{ctrllev[-1]}'] = len(cf)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    ctrlstr.pop()
-                                    ctrllev.pop()
-                                
-                                case 'do':
-                                    ctrlnum += 1
-                                    ctrlstr.append('do')
-                                    ctrllev.append(ctrlnum)
-                                    cf.append(CODE_DSRS)
-                                    labset[f'do_{ctrllev[-1]}'] = len(cf)
-                                    cf.append(CODE_RSDS)
-                                    cf.append(CODE_DUP)
-                                    cf.append(CODE_DSRS)
-                                    cf.append(CODE_JEQ)
-                                    labref[len(cf)] = f'loop_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    
-                                case 'loop':
-                                    if ctrlstr[-1] != 'do':
-                                        logger.error(f"loop outside do")
+                        case 'normal':
+
+                            if word in consts:
+                                x = consts[word]
+                                if 0 <= x <= 255:
+                                    cf.append(CODE_BYTE)
+                                    cf.append( x )
+                                    if perword:
+                                        say(f"Added byte {x} as const {word}")
+                                else:
+                                    s = 0 if x >= 0 else 128
+                                    x = abs(x)
+                                    x1 = x // 256
+                                    x2 = x % 256
+                                    cf.append(CODE_NUMBER)
+                                    cf.append( s | x1 )
+                                    cf.append( x2 )
+                                    if perword:
+                                        say(f"Added number {x} as const {word}")
+                                state = 'normal'
+                                continue
+
+                            if word in pseudos:
+                                if perword:
+                                    say(f": pseudo '{word}' detected...")
+
+                                match word:
+
+                                    case 'label':
+                                        state = 'deflabel'
+
+                                    case 'const':
+                                        state = 'defconst1'
+
+                                    case 'if':
+                                        ctrlnum += 1
+                                        ctrllev.append(ctrlnum)
+                                        ctrlstr.append('if')
+                                        cf.append(CODE_JEQ)
+                                        refer(f'if_{ctrllev[-1]}')
+
+                                    case 'else':
+                                        if not ctrlstr or ctrlstr[-1] != 'if':
+                                            diag('error', "else outside if", iline, word)
+                                            raise EOP
+                                        ctrlstr[-1] = 'ifelse'
+                                        cf.append(CODE_JUMP)
+                                        refer(f'else_{ctrllev[-1]}')
+                                        define(f'if_{ctrllev[-1]}')
+
+                                    case 'then':
+                                        if ctrlstr and ctrlstr[-1] == 'if':
+                                            define(f'if_{ctrllev[-1]}')
+                                        elif ctrlstr and ctrlstr[-1] == 'ifelse':
+                                            define(f'else_{ctrllev[-1]}')
+                                        else:
+                                            diag('error', "then outside if", iline, word)
+                                            raise EOP
+                                        ctrlstr.pop()
+                                        ctrllev.pop()
+
+                                    case 'begin':
+                                        ctrlnum += 1
+                                        ctrllev.append(ctrlnum)
+                                        ctrlstr.append('begin')
+                                        define(f'begin_{ctrllev[-1]}')
+
+                                    case 'while':
+                                        if not ctrlstr or ctrlstr[-1] != 'begin':
+                                            diag('error', "while outside begin", iline, word)
+                                            raise EOP
+                                        cf.append(CODE_JEQ)
+                                        refer(f'repeat_{ctrllev[-1]}')
+
+                                    case 'repeat':
+                                        if not ctrlstr or ctrlstr[-1] != 'begin':
+                                            diag('error', "repeat outside begin", iline, word)
+                                            raise EOP
+                                        cf.append(CODE_JUMP)
+                                        refer(f'begin_{ctrllev[-1]}')
+                                        define(f'repeat_{ctrllev[-1]}')
+                                        ctrlstr.pop()
+                                        ctrllev.pop()
+
+                                    case 'do':
+                                        ctrlnum += 1
+                                        ctrlstr.append('do')
+                                        ctrllev.append(ctrlnum)
+                                        cf.append(CODE_DSRS)
+                                        define(f'do_{ctrllev[-1]}')
+                                        if optlev >= 1:
+                                            # jrz = rsds dup dsrs jeq
+                                            cf.append(CODE_JRZ)
+                                            refer(f'loop_{ctrllev[-1]}')
+                                            define(f'body_{ctrllev[-1]}')
+                                        else:
+                                            cf.append(CODE_RSDS)
+                                            cf.append(CODE_DUP)
+                                            cf.append(CODE_DSRS)
+                                            cf.append(CODE_JEQ)
+                                            refer(f'loop_{ctrllev[-1]}')
+
+                                    case 'loop':
+                                        if not ctrlstr or ctrlstr[-1] != 'do':
+                                            diag('error', "loop outside do", iline, word)
+                                            raise EOP
+                                        if optlev >= 1:
+                                            # djnz = rsds byte 1 sub dsrs jump <do> + jrz
+                                            cf.append(CODE_DJNZ)
+                                            refer(f'body_{ctrllev[-1]}')
+                                        else:
+                                            cf.append(CODE_RSDS)
+                                            cf.append(CODE_BYTE)
+                                            cf.append(1)
+                                            cf.append(CODE_SUB)
+                                            cf.append(CODE_DSRS)
+                                            cf.append(CODE_JUMP)
+                                            refer(f'do_{ctrllev[-1]}')
+                                        define(f'loop_{ctrllev[-1]}')
+                                        ctrlstr.pop()
+                                        ctrllev.pop()
+
+                                    case _:
+                                        diag('warning', f"Cannot find exec for pseudo '{word}'", iline, word)
+                                        state = 'normal'
+
+                            elif word in name2code:
+                                addcode = name2code[word]
+                                cf.append(addcode)
+                                if perword:
+                                    say(f"\t({addcode=})")
+
+                                match word:
+
+                                    case 'byte':
+                                        state = 'getbyte'
+
+                                    case 'number':
+                                        state = 'getnumber'
+
+                                    case 'char':
+                                        state = 'getchar'
+
+                                    case 'string':
+                                        state = 'getstring'
+
+                                    case 'jump' | 'jeq' | 'jne' | 'jge' | 'jgt' | 'jle' | 'jlt' | 'jof' | 'jef' | 'calld' | 'addr' | 'jrz' | 'djnz' :
+                                        state = 'reflabel'
+
+                                    case 'end':
+                                        if perword:
+                                            say("End of program...")
                                         raise EOP
-                                    cf.append(CODE_RSDS)
+
+                            else:
+                                n = int(word)
+
+                                if 0 <= n <= 255:
                                     cf.append(CODE_BYTE)
-                                    cf.append(1)
-                                    cf.append(CODE_SUB)
-                                    cf.append(CODE_DSRS)
-                                    cf.append(CODE_JUMP)
-                                    labref[len(cf)] = f'do_{ctrllev[-1]}'
-                                    cf.append(0)
-                                    cf.append(0)
-                                    labset[f'loop_{ctrllev[-1]}'] = len(cf)
-                                    logger.debug(f"{ctrlnum=}, {ctrlstr[-1]=}, {ctrllev=}")
-                                    ctrlstr.pop()
-                                    ctrllev.pop()
-                                
-                                case _:
-                                    print(f"Cannot find exec for pseudo '{word}'")
-                                    logger.error(f"Cannot find exec for pseudo '{word=}'")
-                                    state = 'normal'                                    
-
-                        elif word in name2code:
-                            addcode = name2code[word]['code']
-                            cf.append(addcode) 
-                            print(f"\t({addcode=})")
-                            logger.info(f"({addcode=})")
-                            
-                            match word:
-                                
-                                case 'byte':
-                                    state = 'getbyte'
-                                
-                                case 'number':
-                                    state = 'getnumber'
-                                
-                                case 'char':
-                                    state = 'getchar'
-                                
-                                case 'string':
-                                    state = 'getstring'
-                                
-                                case 'jump' | 'jeq' | 'jne' | 'jge' | 'jgt' | 'jle' | 'jlt' | 'jof' | 'jef' | 'calld' | 'addr' :
-                                    state = 'reflabel'
-                                
-                                case 'end':
-                                    print("\nEnd of program...", end=" ")
-                                    logger.info("End of program...")
+                                    cf.append(n)
+
+                                elif -32768 <= n <= 32767:
+                                    s = 0 if n >= 0 else 128
+                                    n = abs(n)
+                                    x1 = n // 256
+                                    x2 = n % 256
+                                    cf.append(CODE_NUMBER)
+                                    cf.append( s | x1 )
+                                    cf.append( x2 )
+
+                                else:
+                                    diag('error', f"number out of range: {n}", iline, word)
                                     raise EOP
 
-                        else:
-                            print(f"{state=}, {word=}, {len(cf)=}")
-                            n = int(word)
-                            
-                            if 0 <= n <= 255:
-                                cf.append(73)
-                                cf.append(n)
-                                
-                            elif -32768 <= n <= 32767:
-                                s = 0 if n >= 0 else 128
-                                n = abs(n)
-                                x1 = n // 256
-                                x2 = n % 256
-                                cf.append(74)
-                                cf.append( s | x1 )
-                                cf.append( x2 )                                
-                                
+                                state = 'normal'
+
+                        case 'defconst1':
+
+                            if (word in name2code or
+                                word in pseudos or
+                                word in macros):
+                                diag('error', f"const '{word}' is duplicate.", iline, word)
                             else:
-                                print("Value Error")
-                                logger.error("Value Error")
-                                raise ValueError
+                                state = 'defconst2'
+                                const_name = word
+
+                        case 'defconst2':
+
+                            try:
+                                x = int(word)
+                                consts[const_name] = x
+                            except ValueError:
+                                diag('error', f"bad number for constant: {word}", iline, word)
+                            if perword:
+                                say(f"{consts=}")
+
+                            state = 'normal'
+
+                        case 'deflabel':
+
+                            if word in labset:
+                                diag('error', f"Duplicate label: {word}", iline, word)
+                                raise EOP
+
+                            # ok
+                            if perword:
+                                say(f"deflabel: {len(cf)=}, {word=}")
+                            define(word)
 
-                            print()                            
                             state = 'normal'
 
-                    case 'defconst1':
-                        
-                        if (word in name2code or 
-                            word in pseudos or 
-                            word in macros):
-                            print(f"Errorr: const '{word}' is duplicate.")
-                            logger.error(f"Errorr: const '{word}' is duplicate.")
-                        else:
-                            state = 'defconst2'
-                            const_name = word
-
-                    case 'defconst2':
-                        
-                        try:
+                        case 'reflabel':
+
+                            if perword:
+                                say(f"reflabel: {len(cf)=}, {word=}")
+                            refer(word)
+
+                            state = 'normal'
+
+                        case 'getbyte':
+
+                            cf.append(int(word) % 256)
+
+                            state = 'normal'
+
+                        case 'getnumber':
+
                             x = int(word)
-                            consts[const_name] = x
-                        except:
-                            print(f"Error: bad number for constant: {word}")
-                        print(f"{consts=}")
-                        logger.info(f"{consts=}")
-                            
-                        state = 'normal'
+                            s = 0 if x >= 0 else 128
+                            x = abs(x)
+                            x1 = x // 256
+                            x2 = x % 256
+                            cf.append( s | x1 )
+                            cf.append( x2 )
 
-                    case 'deflabel':                    
-                        
-                        if word in labset:
-                            print(f"Duplicate label: {word}")
-                            logger.error(f"Duplicate label: {word}")
-                            raise EOP
-                        
-                        # ok
-                        print(f"deflabel: {len(cf)=}, {word=}")
-                        logger.info(f"deflabel: {len(cf)=}, {word=}")
-                        labset[word] = len(cf)
-                        # labset[word] = len(cf) - HEADLEN
-                        # logger.debug(labels)
-                        print()
-                        
-                        state = 'normal'
+                            state = 'normal'
 
-                    case 'reflabel':                    
-                        
-                        print(f"reflabel: {len(cf)=}, {word=}")
-                        logger.info(f"reflabel: {len(cf)=}, {word=}")
-                        labref[len(cf)] = word
-                        # labref[len(cf) - HEADLEN] = word
-                        cf.append(0)
-                        cf.append(0)
-                        # print()
-                        # logger.debug(labels)
-                        
-                        state = 'normal'
+                        case 'getchar':
 
-                    case 'getbyte':
+                            cf.append( ord(word) )
 
-                        cf.append(int(word) % 256)
-                        
-                        state = 'normal'
+                            state = 'normal'
 
-                    case 'getnumber':
+                        case 'getstring':
 
-                        s = 0 if word >= 0 else 128
-                        word = abs(word)
-                        x1 = word // 256
-                        x2 = word % 256
-                        cf.append( s | x1 )
-                        cf.append( x2 )
-                        
-                        state = 'normal'
+                            los = len(word)
+                            if los >= 256:
+                                diag('error', f"String too long: {los}", iline, word)
+                                raise EOP
+                            cf.append( los )
+                            for c in word:
+                                cf.append( ord(c) )
 
-                    case 'getchar':
+                            state = 'normal'
 
-                        cf.append( ord(word) )
-                        
-                        state = 'normal'
+                        case _:
 
-                    case 'getstring':
+                            diag('warning', f"Strange word: {word}", iline, word)
 
-                        los = len(word)
-                        if los >= 256:
-                            logger.error("String too long: " + int(los))
-                            raise ValueError
-                        cf.append( los )
-                        for c in word:
-                            cf.append( ord(c) )
-                        
-                        state = 'normal'
+                            state = 'normal'
 
-                    case _:
+        except EOP:
+            if summary:
+                say("Program text processed.")
 
-                        logger.error("Strange word: " + word)
-                        
-                        state = 'normal'
-                        
-    except AssertionError as e:
-        print(f"Assertion failed: {e}")
-        logger.error(f"Assertion failed: {e}")
-        isError = True
-        
-    except EOP:
-        print(f"File {inname} processed.")
-
-if cf[-1] != CODE_END:
-    cf.append(CODE_END)
-    print("Opcode for END added.")
-    logger.info("Opcode for END added.")
-
-print("done.")
-
-# file processing done.
-
-# show and process labels:
-
-if labset:
-    print("\nLabels:")
-    print(f"{labset=}")
-    print(f"{labref=}")
-
-    logger.info("Labels:")
-    logger.info(f"{labset=}")
-    logger.info(f"{labref=}")
-
-    for k, v in labref.items():
-        x = labset[v]
-        x1 = x // 256
-        x2 = x % 256
-        cf[k] = x1
-        cf[k+1] = x2
-        # cf[k + HEADLEN] = x1
-        # cf[k+1 + HEADLEN] = x2
-    
-else:
-    print("\nNo labels defined.")
-    logger.info("No labels defined.")
-
-# show macros:
-
-if macros:
-    lom = ", " .join (list(macros.keys()))
-    print(f"\nMacros defined: {lom}")
-    logger.info(f"Macros defined: {lom}")
-else:
-    print("\nNo macros defined.")
-    logger.info("No macros defined.")
-
-# make checksum
-
-cf.append( sum(cf) % 256 )
-
-# save cf in binary file
-
-with open(outname, 'wb') as outfile:
-    outfile.write(cf)
-
-# Job done:
-
-print("\nJob done %s.\n" % ("with errors" if isError else "without errors"))
-logger.info("Job done %s.\n" % ("with errors" if isError else "without errors"))
+        except (ValueError, TypeError) as e:
+            diag('error', f"bad word: {e}", iline, word)
+
+        if len(cf) > cfmax and not toolong:
+            try:
+                too_long()
+            except EOP:
+                pass
+
+        if len(cf) == HEADLEN or cf[-1] != CODE_END:
+            cf.append(CODE_END)
+            if summary:
+                say("Opcode for END added.")
+
+        # file processing done.
+
+        # optimize:
+
+        # (format 13 is always laid out anew, to move strings to the pool)
+
+        pool = b''
+
+        if (optlev >= 1 or not inline) and not self.errors and not self.stream:
+            nbytes1 = len(cf)
+            prog = lift(cf, labset, labref, LENGTHS_BY_FORMAT[image])
+            count1, _ = size(prog)
+            if optlev >= 1:
+                prog = optimize(prog, optlev)
+            count2, _ = size(prog)
+            cf, labset, labref, pool = assemble(prog, fmt, short=optlev >= 1)
+            nbytes2 = len(cf) + len(pool) + (0 if inline else HEADLEN)
+            self.saved = (nbytes1 - nbytes2, count1 - count2)
+
+            if summary and optlev >= 1:
+                say(f"Optimizer -O{optlev}: saved {nbytes1 - nbytes2} bytes, {count1 - count2} instructions.")
+
+        # fix up labels:
+
+        # (after code too long, labels past the stop are not undefined, only not reached)
+
+        if self.stream and not toolong:
+            for name in pending:
+                diag('error', f"Undefined label: {name}", reflines[name], name)
+
+        for k, v in labref.items():
+            if toolong:
+                # addresses past the end may not fit, and the code is not run
+                continue
+            if v not in labset:
+                if v in reflines:
+                    diag('error', f"Undefined label: {v}", reflines.pop(v), v)
+                continue
+            cf[k:k+width] = labset[v].to_bytes(width)
+
+        # make checksum, or sections
+
+        if inline:
+            cf.append( sum(cf) % 256 )
+            self.cf = bytes(cf)
+        elif self.errors:
+            # code as it is, not to be run
+            self.cf = ksmobj.pack(bytes(cf[HEADLEN:]))
+        else:
+            self.cf = ksmobj.pack(bytes(cf), bytes(pool), labset)
+        self.labset = labset
+        self.labref = labref
+        self.macros = dict(macros)
+        self.consts = consts
+        self.lines = iline
+
+        return self.cf
+
+# --------------------------------------------------------------
+# cache of compiled code
+
+class CompileCache:
+    """compiled code in a directory, found by a hash of everything it depends on:
+    source text, opcodes.tsv, version and optimization level
+
+    Each entry is two files: key.smb with the code and key.json with
+    labels, macros, consts and diagnostics. Using an entry touches it;
+    when the directory grows over maxsize bytes, entries used longest
+    ago are removed. Files are written under temporary names and then
+    renamed, so many processes can share one cache.
+    """
+
+    def __init__(self, path: str = CACHE_DIR, maxsize: int = CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, source: str, optlev: int, fmt: str = version) -> str:
+        """cache key of source compiled at optlev into format fmt"""
+
+        import hashlib      # only when the cache is used, not on every start
+
+        h = hashlib.sha256()
+        h.update(f"SM{fmt}\0O{optlev}\0R{CACHE_REV}\0".encode('ascii'))
+        h.update(ksmop.digest.encode('ascii'))
+        h.update(b'\0')
+        h.update(source.encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key: str) -> tuple[bytes, dict] | None:
+        """code and its info for key, None if not in cache"""
+
+        import json
+
+        name = os.path.join(self.path, key)
+        try:
+            with open(name + '.smb', 'rb') as smbfile:
+                cf = smbfile.read()
+            with open(name + '.json', 'rt') as jsonfile:
+                info = json.load(jsonfile)
+            os.utime(name + '.smb')
+            os.utime(name + '.json')
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cf, info
+
+    def put(self, key: str, cf: bytes, info: dict) -> None:
+        """store code and its info under key, then keep the cache in size;
+        the cache is only a help, so if it can not be written, nothing is
+        """
+
+        import json
+
+        name = os.path.join(self.path, key)
+        tmp = f"{name}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wt') as jsonfile:
+                json.dump(info, jsonfile)
+            os.replace(tmp, name + '.json')
+            with open(tmp, 'wb') as smbfile:
+                smbfile.write(cf)
+            os.replace(tmp, name + '.smb')
+        except OSError as e:
+            logger.warning(f"Compiled code not cached: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """remove entries used longest ago while the cache is over maxsize"""
+
+        entries = {}        # key -> [last use, size]
+        total = 0
+        try:
+            found = list(os.scandir(self.path))
+        except OSError:
+            return
+        for entry in found:
+            key, ext = os.path.splitext(entry.name)
+            if ext not in ('.smb', '.json'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                # removed by another process meanwhile
+                continue
+            e = entries.setdefault(key, [0, 0])
+            e[0] = max(e[0], st.st_mtime)
+            e[1] += st.st_size
+            total += st.st_size
+
+        for key, (used, nbytes) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.maxsize:
+                break
+            for ext in ('.smb', '.json'):
+                try:
+                    os.remove(os.path.join(self.path, key + ext))
+                except OSError:
+                    pass
+            total -= nbytes
+
+    def clear(self) -> None:
+        """remove all entries"""
+
+        maxsize = self.maxsize
+        self.maxsize = 0
+        self.evict()
+        self.maxsize = maxsize
+
+def open_cache(path: str = CACHE_DIR, maxsize: int = CACHE_SIZE) -> CompileCache | None:
+    """compiled code cache in path, None with a warning if the directory
+    can not be made: compiling does not need the cache
+    """
+
+    try:
+        return CompileCache(path, maxsize)
+    except OSError as e:
+        print(f"Warning: compiled code cache is off: {e}", file=sys.stderr)
+        return None
+
+# compiler for compile(), made on first use
+_compiler = None
+
+def compile(source: str, optlev: int = 0) -> bytes:
+    """compile program text source into byte code, in memory, quietly;
+    use Compiler for labels and diagnostics
+    """
+
+    global _compiler
+    if _compiler is None:
+        _compiler = Compiler()
+    _compiler.optlev = optlev
+    return _compiler.compile(source)
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """compile program named in command line (default prog01), as a script"""
+
+    parser = argparse.ArgumentParser(description="Stack machine byte code compiler")
+    parser.add_argument('program', nargs='?', default='prog01',
+                        help="program name, extension is ignored")
+    parser.add_argument('-O', dest='optlev', type=int, default=0, metavar='LEVEL',
+                        help="optimization level: 0 none, "
+                             "1 fused codes for do/loop and safe peephole changes, "
+                             "2 also constant folding and dead code removal")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="always compile, do not use the compiled code cache")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, metavar='DIR',
+                        help=f"compiled code cache directory (default {CACHE_DIR})")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the source line by line and fix up labels on the fly, "
+                             "for very big sources (no cache, no optimizer passes)")
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default=version,
+                        help=f"code file format: 11 (2 byte addresses, up to 64 KiB), "
+                             f"12 (3 byte addresses, up to 16 MiB, short jumps with -O1), "
+                             f"13 (as 12, in sections with string pool, labels and CRC32) "
+                             f"(default {version})")
+    parser.add_argument('-v', '--verbose', type=int, default=VERBOSE_WORDS, metavar='LEVEL',
+                        help="what to print and log: 0 nothing, 1 summary and errors, "
+                             "2 also every line, 3 also every word (default, slow)")
+    parser.add_argument('--stats', action='store_true',
+                        help="print lines, code size, labels, macros and time")
+    parser.add_argument('--log', choices=CHOICES, default='WARNING', type=str.upper,
+                        help="least level written to .sml, as much as --verbose gives "
+                             "(default WARNING: errors and warnings; the file is made "
+                             "only if there is something to write)")
+    args = parser.parse_args(argv)
+
+    if args.stream and args.fmt in SECTIONED:
+        parser.error(f"--stream does not write format {args.fmt}")
+
+    verbose = args.verbose
+    summary = verbose >= VERBOSE_SUMMARY
+
+    if summary:
+        print(f"{sys.argv=}")
+
+    # in/out file names
+
+    inout = args.program
+
+    if len(inout) > 4 and inout[-4] == '.':
+        inout = inout[:-4]
+
+    inname  = inout + '.smt'     # state machine program text
+    outname = inout + '.smb'     # state machine program binary
+    logname = inout + '.sml'     # state machine log file
+
+    ksmlog.setup((logname, args.log))
+
+    if summary:
+        print(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
+        logger.info(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
+
+    # read file with program, write byte code
+
+    cache = open_cache(args.cache_dir) if args.cache and not args.stream else None
+    compiler = Compiler(args.optlev, verbose=verbose, cache=cache, stream=args.stream,
+                        fmt=args.fmt)
+
+    t0 = time.perf_counter()
+    with open(inname, 'rt') as inf:
+        if args.stream:
+            cf = compiler.compile_lines(inf)
+        else:
+            cf = compiler.compile(inf.read())
+    t1 = time.perf_counter()
+
+    if summary:
+        print("done.")
+
+    # show labels and macros:
+
+    if verbose >= VERBOSE_LINES:
+        if compiler.labset:
+            print("\nLabels:")
+            print(f"labset={compiler.labset}")
+            print(f"labref={compiler.labref}")
+
+            logger.info("Labels:")
+            logger.info(f"labset={compiler.labset}")
+            logger.info(f"labref={compiler.labref}")
+
+        else:
+            print("\nNo labels defined.")
+            logger.info("No labels defined.")
+
+    if summary:
+        if compiler.macros:
+            lom = ", " .join (list(compiler.macros.keys()))
+            print(f"\nMacros defined: {lom}")
+            logger.info(f"Macros defined: {lom}")
+        else:
+            print("\nNo macros defined.")
+            logger.info("No macros defined.")
+
+    # save cf in binary file
+
+    with open(outname, 'wb') as outfile:
+        outfile.write(cf)
+
+    if args.stats:
+        t = t1 - t0
+        print(f"\nLines: {compiler.lines}, code: {len(cf)} bytes, "
+              f"labels: {len(compiler.labset)}, macros: {len(compiler.macros)}, "
+              f"consts: {len(compiler.consts)}, errors: {len(compiler.errors)}, "
+              f"time: {t * 1000:.1f} ms ({compiler.lines / t:.0f} lines/s)"
+              f"{', from cache' if compiler.cached else ''}")
+
+    # Job done:
+
+    isError = bool(compiler.errors)
+    if summary:
+        print("\nJob done %s.\n" % ("with errors" if isError else "without errors"))
+        logger.info("Job done %s.\n" % ("with errors" if isError else "without errors"))
+
+if __name__ == '__main__':
+    main()
 
 # --------------------------------------------------------------
 # end of code
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmcr, компиляция и запуск программы в одном процессе
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# imports
+
+import sys
+import argparse
+
+from ksmc import Compiler, CompileCache, CACHE_DIR, version, open_cache
+from ksmop import FORMATS
+from ksmr import VM, Output
+import ksmlog
+
+# --------------------------------------------------------------
+# compile and run
+
+def compile_and_run(source: str, optlev: int = 0, cache: CompileCache | None = None,
+                    out: Output | None = None, max_steps: int | None = None,
+                    fmt: str = version) -> VM:
+    """compile program text source (from cache if there), run it,
+    return the machine; if it does not compile, the machine is
+    in state error with the first error message
+    """
+
+    compiler = Compiler(optlev, cache=cache, fmt=fmt)
+    cf = compiler.compile(source)
+    vm = VM(out)
+
+    errors = compiler.errors
+    if errors:
+        d = errors[0]
+        vm.state = 'error'
+        vm.error = f"{d['message']} (line {d['line']})" if d['line'] else d['message']
+        return vm
+
+    vm.load(cf)
+    vm.run(max_steps)
+    return vm
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """compile and run program named in command line (default prog01)"""
+
+    parser = argparse.ArgumentParser(description="Compile and run a stack machine program")
+    parser.add_argument('program', nargs='?', default='prog01',
+                        help="program name, extension is ignored")
+    parser.add_argument('-O', dest='optlev', type=int, default=0, metavar='LEVEL',
+                        help="optimization level, as for ksmc")
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default=version,
+                        help="code file format, as for ksmc")
+    parser.add_argument('--steps', type=int, default=None,
+                        help="stop after this many codes")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="always compile, do not use the compiled code cache")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, metavar='DIR',
+                        help=f"compiled code cache directory (default {CACHE_DIR})")
+    args = parser.parse_args(argv)
+
+    inout = args.program
+
+    if len(inout) > 4 and inout[-4] == '.':
+        inout = inout[:-4]
+
+    inname = inout + '.smt'      # state machine program text
+
+    ksmlog.setup((sys.stderr, 'WARNING'))
+
+    with open(inname, 'rt') as inf:
+        source = inf.read()
+
+    cache = open_cache(args.cache_dir) if args.cache else None
+    vm = compile_and_run(source, args.optlev, cache, max_steps=args.steps, fmt=args.fmt)
+
+    if vm.state == 'error':
+        print(f"\nError: {vm.error}")
+        raise SystemExit(1)
+    print()
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
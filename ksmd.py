@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 # Mikhail (myke) Kolodin
-# 2025-05-27 2025-06-06 1.0.8
+# 2025-05-27 2026-10-17 1.0.8
 
 # --------------------------------------------------------------
 # Стековая машина - Stack machine
-# ksmc, bytes codes compiler, декомпилятор из байт-кода
+# ksmd, byte code decompiler, декомпилятор из байт-кода
 # --------------------------------------------------------------
 
 # --------------------------------------------------------------
@@ -12,152 +12,383 @@
 
 version = '11'
 
+BATCH = 4096        # lines formatted before they are written out
+
 # --------------------------------------------------------------
 # imports
 
 import sys
-from loguru import logger
-from pprint import pp, pprint
-
-# --------------------------------------------------------------
-# in/out file names
-
-if len(sys.argv) > 1:
-    inout = sys.argv[1]
-else:
-    inout = 'prog01'
-
-if len(inout) > 4 and inout[-4] == '.':
-    inout = inout[:-4]
-    
-inname  = inout + '.smb'     # state machine program binary
-decname = inout + '.smd'     # state machine program decomplied
-logname = inout + '.sml'     # state machine log file
+import argparse
+import contextlib
+from typing import Iterable, Iterator, NamedTuple
 
-logger.add(logname)
+from ksmop import NAMES, BASE, FORMATS, ADDR_CODES, SHORT_CODES, LENGTHS_BY_FORMAT, SECTIONED
+import ksmobj
+from ksmlog import logger, CHOICES
+import ksmlog
 
-print(f"Files: {inout=}, {inname=}, {decname=}, {logname=}")
-logger.info(f"Files: {inout=}, {inname=}, {decname=}, {logname=}")
+# --------------------------------------------------------------
+# constants
 
 HEADLEN = 4                  # length of code file header
 
 # opcodes, special
 CODE_STOP    =  1
 CODE_END     = 2
+CODE_CHAR    = 70
 CODE_STRING  = 72
+CODE_BYTE    = 73
+CODE_NUMBER  = 74
 
-# --------------------------------------------------------------
-# get data about machine codes
-
-codes = []
-
-## normal version, with tabs, checked + corrected
-codesname = 'opcodes.tsv'
-with open(codesname, 'rt') as codesfile:
-    line = codesfile.readline()
-    for line in codesfile.readlines():
-        c, n, b, d = line.strip().split('\t', maxsplit=3)
-        c = int(c)
-        b = int(b)
-        codes.append((c, n, b, d))
-# pprint(codes)
-
-code2name = {}
-for c, n, b, d in codes:
-    code2name[c] = {'code': c, 'name': n, 'bytes': b, 'description': d}
-# pprint(code2name)
+# words that can not follow char in program text
+COMMENTS = ('#', ';')
 
-# --------------------------------------------------------------
-# read file with program, decompile byte code
+class DecompileError(Exception):
+    """code file can not be decompiled"""
 
-with open(inname, 'rb') as infile:
-    print(f"Reading code file from {inname} ...", end=" ")
-    cf = infile.read()
-    print("done.")
-    
-# print(cf)
+class Instr(NamedTuple):
+    """one instruction of byte code"""
+
+    addr: int                   # address of the code
+    code: int
+    name: str                   # '???' if there is no such code
+    length: int                 # bytes, with operand and inline string
+    arg: int | None = None      # operand: number, short jump offset, address, string address
+    target: int | None = None   # address jumped to, called or loaded by addr
+    string: bytes | None = None # string of code 72
 
 # --------------------------------------------------------------
-# check versions
+# read byte code
 
-if cf[:2] != 'SM'.encode('ascii'):
-    print('The file read is not a binary from Stack Machine.')
-    raise SystemExit
+def open_code(cf) -> tuple[str, memoryview, memoryview, int, int, dict[str, int]]:
+    """format of code file cf, its code and strings, addresses of the first code
+    and after the last one, labels kept in the file (format 13); nothing is copied
+    """
 
-if cf[2:4] != version.encode('ascii'):
-    print('The file read is from Stack Machine of wrong version.')
-    raise SystemExit
+    cf = memoryview(cf)
 
-# --------------------------------------------------------------
-# check checksum
+    if cf[:2] != 'SM'.encode('ascii'):
+        raise DecompileError('The file read is not a binary from Stack Machine.')
+
+    fmt = bytes(cf[2:4]).decode('ascii', errors='replace')
+
+    if fmt not in FORMATS:
+        raise DecompileError('The file read is from Stack Machine of wrong version.')
+
+    if fmt in SECTIONED:
+        try:
+            sections = ksmobj.unpack(cf)
+        except ksmobj.FormatError as e:
+            raise DecompileError(str(e)) from None
+        code = sections['CODE']
+        return fmt, code, sections['DATA'], 0, len(code), ksmobj.labels(sections['SYMS'])
+
+    if ksmobj.checksum(cf) != cf[-1]:
+        raise DecompileError("Bad code file checksum.")
+
+    return fmt, cf, cf, HEADLEN, len(cf) - 1, {}
+
+def disassemble(cf) -> Iterator[Instr]:
+    """instructions of code file cf, one by one, in order of addresses"""
+
+    fmt, code, data, start, stop, _ = open_code(cf)
+    return instructions(fmt, code, data, start, stop)
+
+def instructions(fmt: str, code, data, icode: int, stop: int) -> Iterator[Instr]:
+    """instructions of code from address icode to stop, strings are in data"""
+
+    lengths = LENGTHS_BY_FORMAT[fmt]
+    inline = fmt not in SECTIONED
 
-csum = sum(cf[:-1]) % 256
+    while icode < stop:
+        c = code[icode]
+        base = BASE[c]
+        name = NAMES[c] or '???'
+        oplen = lengths[c] or 1
+        arg = target = string = None
 
-assert csum == cf[-1], "Bad code file checksum."
+        if icode + oplen > stop:
+            # cut short, show what is there
+            yield Instr(icode, c, name, stop - icode)
+            return
+
+        if c in SHORT_CODES:
+            d = code[icode+1]
+            arg = d - 256 if d >= 128 else d
+            target = icode + 2 + arg
+        elif base in ADDR_CODES:
+            arg = target = int.from_bytes(code[icode+1:icode+oplen])
+        elif c == CODE_STRING:
+            arg = icode + 1 if inline else int.from_bytes(code[icode+1:icode+oplen])
+            string = bytes(data[arg+1:arg+1+data[arg]])
+            if inline:
+                oplen += len(string) + 1
+        elif c == CODE_NUMBER:
+            x1 = code[icode+1]
+            arg = ((x1 & 127) * 256 + code[icode+2]) * (-1 if x1 & 128 else 1)
+        elif oplen == 2:
+            arg = code[icode+1]
+
+        yield Instr(icode, c, name, oplen, arg, target, string)
+        icode += oplen
+
+def find_labels(instrs: Iterable[Instr], symbols: dict[str, int] | None = None) -> dict[int, str]:
+    """labels kept in the file (symbols), one for an address, and labels
+    for other addresses jumped to, called or loaded by addr: L and the address
+    """
+
+    labels = {}
+    for name, a in (symbols or {}).items():
+        labels.setdefault(a, name)
+
+    for ins in instrs:
+        a = ins.target
+        if a is not None and a not in labels:
+            labels[a] = f"L{a:04}"
+    return dict(sorted(labels.items()))
 
 # --------------------------------------------------------------
-# prepare machine
+# write decompiled code
+
+def flush(parts: list[str], file) -> None:
+    """write parts out as one piece, forget them"""
+
+    file.write(''.join(parts))
+    parts.clear()
+
+def text_line(ins: Instr, labels: dict[int, str]) -> str:
+    """instruction as a line of listing"""
+
+    if ins.target is not None:
+        params = f"{ins.target:6}"
+        if ins.code in SHORT_CODES:
+            params += f" ({ins.arg:+})"
+        if ins.target in labels:
+            params += f" {labels[ins.target]}"
+    elif ins.string is not None:
+        params = f"({ins.arg}) {len(ins.string)}:{ins.string.decode('latin-1')!r}"
+    elif ins.arg is not None:
+        params = f"{ins.arg:6}"
+    else:
+        params = ''
+    return f"{ins.addr:04} {ins.code:03} ({ins.code:02X}) {ins.name:10} {params}\n"
+
+def write_text(instrs: Iterable[Instr], file, labels: dict[int, str] | None = None) -> int:
+    """listing: address, code, name, operand; label lines before their codes;
+    return number of instructions
+    """
+
+    labels = labels or {}
+    parts = [f"{'addr':4} dec (xx) {'opname':10} params\n",
+             f"{'----':4} --- ---- {'----------':10} ------\n"]
+
+    count = 0
+    for count, ins in enumerate(instrs, 1):
+        if ins.addr in labels:
+            parts.append(f"{'':18} label {labels[ins.addr]}\n")
+        parts.append(text_line(ins, labels))
+        if len(parts) >= BATCH:
+            flush(parts, file)
+
+    flush(parts, file)
+    return count
+
+def write_json(instrs: Iterable[Instr], file, labels: dict[int, str] | None = None,
+               fmt: str = version) -> int:
+    """json: {"format", "labels": {address: name}, "code": [instructions]},
+    strings as latin-1 text; return number of instructions
+    """
+
+    import json     # only here, not on every start
+
+    labels = labels or {}
+    file.write(f'{{"format": "{fmt}",\n "labels": {json.dumps({str(a): n for a, n in labels.items()})},\n "code": [\n')
+
+    parts = []
+    sep = ''
+    count = 0
+    for count, ins in enumerate(instrs, 1):
+        d = ins._asdict()
+        if ins.string is not None:
+            d['string'] = ins.string.decode('latin-1')
+        if ins.addr in labels:
+            d['label'] = labels[ins.addr]
+        parts.append(sep + json.dumps(d))
+        sep = ',\n'
+        if len(parts) >= BATCH:
+            flush(parts, file)
+
+    parts.append('\n]}\n')
+    flush(parts, file)
+    return count
 
-print(f"Writing decomplied text to {decname}.\n")
+def smt_word(ins: Instr, labels: dict[int, str], last: bool) -> str:
+    """instruction as words of program text"""
+
+    base = BASE[ins.code]
+
+    if ins.target is not None:
+        return f"{NAMES[base]} {labels[ins.target]}"
+
+    if ins.code == CODE_STRING:
+        text = ins.string.decode('latin-1')
+        if not text or text != ''.join(text.split()) or text.startswith('"') or text.endswith('"'):
+            # words of program text have no spaces
+            return f"; ksmd: string {text!r} can not be written\n    \"{'_'.join(text.split()) or '_'}\""
+        return f'"{text}"'
+
+    if ins.code == CODE_CHAR:
+        ch = chr(ins.arg)
+        if ch.isprintable() and not ch.isspace() and ch not in COMMENTS:
+            return f"char {ch}"
+        return f"byte {ins.arg}"
+
+    if ins.code in (CODE_BYTE, CODE_NUMBER):
+        return f"{ins.name} {ins.arg}"
+
+    if ins.code == CODE_END and not last:
+        # end stops the compiler, stop does the same at run time
+        return "stop"
+
+    if ins.name == '???':
+        return f"; ksmd: no such code {ins.code}"
+
+    return ins.name
+
+def write_smt(instrs: Iterable[Instr], file, labels: dict[int, str], fmt: str = version) -> int:
+    """program text that ksmc compiles back to the same codes
+    (short jumps become long ones); labels must cover all targets;
+    return number of instructions
+    """
+
+    instrs = list(instrs)
+    placed = {ins.addr for ins in instrs}
+
+    parts = [f"; decompiled by ksmd from code file format {fmt}\n\n"]
+    for a in sorted(set(labels) - placed):
+        parts.append(f"; ksmd: label {labels[a]} is at {a}, not at a code\n")
+
+    for i, ins in enumerate(instrs):
+        if ins.addr in labels:
+            parts.append(f"label {labels[ins.addr]}\n")
+        parts.append(f"    {smt_word(ins, labels, i == len(instrs) - 1)}\n")
+        if len(parts) >= BATCH:
+            flush(parts, file)
+
+    if not instrs or instrs[-1].code != CODE_END:
+        parts.append("    end\n")
+    flush(parts, file)
+    return len(instrs)
+
+def decompile(cf, file, kind: str = 'text', labels: bool = False) -> int:
+    """write code file cf decompiled to file as kind: 'text', 'json' or 'smt'
+    (always with labels), with labels for jump targets if asked;
+    return number of instructions
+    """
+
+    fmt, code, data, start, stop, symbols = open_code(cf)
+    instrs = instructions(fmt, code, data, start, stop)
+
+    if labels or kind == 'smt':
+        # targets are needed before the code that jumps back to them
+        instrs = list(instrs)
+        found = find_labels(instrs, symbols)
+    else:
+        found = find_labels((), symbols)
+
+    match kind:
+        case 'text':
+            return write_text(instrs, file, found)
+        case 'json':
+            return write_json(instrs, file, found, fmt)
+        case 'smt':
+            return write_smt(instrs, file, found, fmt)
+        case _:
+            raise ValueError(f"unknown kind of output: {kind}")
 
 # --------------------------------------------------------------
-# decomplie
-
-with open(decname, 'wt') as decfile:
-
-    # icode = -1
-    icode = HEADLEN - 1
-    
-    print(f"{'addr':4} dec (xx) {'opname':10} params")
-    decfile.write(f"{'addr':4} dec (xx) {'opname':10} params\n")
-    print(f"{'----':4} --- ---- {'----------':10} ------")
-    decfile.write(f"{'----':4} --- ---- {'----------':10} ------\n")
-    
-    while icode < len(cf):
-        icode += 1
-        
-        code = cf[icode]
-        
-        # show opname
-        opname = code2name[code]['name']
-        oplen = code2name[code]['bytes']
-        
-        match oplen:
-            
-            case 1:
-                print(f"{icode:04} {code:03} ({code:02X}) {opname:10}", end=" ")
-                decfile.write(f"{icode:04} {code:03} ({code:02X}) {opname:10}")
-                if code == CODE_STOP or code == CODE_END:
-                    break
-                if code == CODE_STRING:
-                    print(f"{cf[icode+1]}:{cf[icode+2:icode+2+cf[icode+1]]}", end=" ")
-                    decfile.write(f"{cf[icode+1]}:{cf[icode+2:icode+2+cf[icode+1]]}")
-                    icode += cf[icode+1] + 1
-                print()
-                decfile.write("\n")                
-            
-            case 2:
-                print(f"{icode:04} {code:03} ({code:02X}) {opname:10} {cf[icode+1]:4}")
-                decfile.write(f"{icode:04} {code:03} ({code:02X}) {opname:10} {cf[icode+1]:4}\n")
-                icode += 1
-            
-            case 3:
-                x1 = cf[icode+1]
-                x2 = cf[icode+2]
-                s = x1 & 128
-                x1 &= 127
-                x = x1 * 256 + x2
-                x *= -1 if s else 1
-                                
-                print(f"{icode:04} {code:03} ({code:02X}) {opname:10} {cf[icode+1]:4} {cf[icode+2]:4} ({x})")
-                decfile.write(f"{icode:04} {code:03} ({code:02X}) {opname:10} {cf[icode+1]:4} {cf[icode+2]:4} ({x})\n")
-                icode += 2
-            
-            case _:
-                print("???")
-                decfile.write("???\n")
-                
-    print("\n\nJob done.\n")
+# command line
+
+class Tee:
+    """file that writes to all files given"""
+
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, text: str) -> None:
+        for f in self.files:
+            f.write(text)
+
+EXTENSIONS = {'text': '.smd', 'json': '.smd.json', 'smt': '.smd.smt'}
+
+def main(argv: list[str] | None = None) -> None:
+    """decompile program named in command line (default prog01), as a script"""
+
+    parser = argparse.ArgumentParser(description="Stack machine byte code decompiler")
+    parser.add_argument('program', nargs='?', default='prog01',
+                        help="program name, extension is ignored")
+    parser.add_argument('--as', dest='kind', choices=list(EXTENSIONS), default='text',
+                        help="text listing (.smd, default), json (.smd.json) "
+                             "or program text for ksmc (.smd.smt)")
+    parser.add_argument('--labels', action='store_true',
+                        help="name jump targets L0012 and so on (program text always has them)")
+    parser.add_argument('--output', choices=['both', 'stdout', 'file'], default='both',
+                        help="where the result goes: screen and file (default), or one of them")
+    parser.add_argument('-o', dest='outname', default=None, metavar='FILE',
+                        help="file to write, instead of the program name and extension")
+    parser.add_argument('--log', choices=CHOICES, default='WARNING', type=str.upper,
+                        help="least level written to .sml (default WARNING: errors only; "
+                             "the file is made only if there is something to write)")
+    args = parser.parse_args(argv)
+
+    # in/out file names
+
+    inout = args.program
+
+    if len(inout) > 4 and inout[-4] == '.':
+        inout = inout[:-4]
+
+    inname  = inout + '.smb'     # state machine program binary
+    decname = args.outname or inout + EXTENSIONS[args.kind]   # state machine program decompiled
+    logname = inout + '.sml'     # state machine log file
+
+    ksmlog.setup((sys.stderr, 'WARNING'), (logname, args.log))
+
+    # messages go to stderr when the result goes to stdout, so it is clean
+    tofile = args.output != 'stdout'
+    msg = sys.stdout if tofile else sys.stderr
+
+    if tofile:
+        print(f"Files: {inout=}, {inname=}, {decname=}, {logname=}", file=msg)
+    else:
+        print(f"Files: {inout=}, {inname=}, {logname=}, result to stdout", file=msg)
+    logger.info(f"Files: {inout=}, {inname=}, {decname=}, {logname=}")
+
+    # map file with program, pages are read as they are used
+
+    print(f"Reading code file from {inname} ...", end=" ", file=msg)
+    cf = ksmobj.map_file(inname)
+    print("done.", file=msg)
+
+    if tofile:
+        print(f"Writing decompiled text to {decname}.\n", file=msg)
+
+    with open(decname, 'wt') if tofile else contextlib.nullcontext() as decfile:
+        files = [decfile] if tofile else []
+        if args.output != 'file':
+            files.append(sys.stdout)
+        try:
+            count = decompile(cf, Tee(*files), args.kind, args.labels)
+        except DecompileError as e:
+            print(e, file=msg)
+            logger.error(str(e))
+            raise SystemExit
+
+    logger.info(f"Decompiled {count} instructions.")
+    print("\n\nJob done.\n", file=msg)
+
+if __name__ == '__main__':
+    main()
 
 # --------------------------------------------------------------
 # end of code
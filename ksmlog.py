@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmlog, журнал: loguru загружается только когда есть что писать
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# setup
+
+# loguru's levels
+LEVELS = {'TRACE': 5, 'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25,
+          'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+OFF = 'OFF'         # level of a sink that takes nothing
+
+# levels for --log of the command lines
+CHOICES = ['DEBUG', 'INFO', 'WARNING', 'ERROR', OFF]
+
+# --------------------------------------------------------------
+# the logger
+
+class Logger:
+    """stands for loguru's logger, which takes long to import
+
+    setup() tells the sinks and their levels; loguru is imported and
+    given the sinks at the first message some sink takes, so messages
+    below all levels cost a method call and no import at all.
+    Without setup() every message goes to loguru as it is, with its
+    default sink (stderr).
+    """
+
+    def __init__(self):
+        self.sinks = None       # (sink, level) pairs, None if not set up
+        self.level = 0          # least level a sink takes
+        self.real = None        # loguru's logger, when set up with the sinks
+
+    def setup(self, *sinks) -> None:
+        """log to sinks: pairs (sink, level), sink is a file name or
+        a stream; pairs with level OFF or None are left out
+        """
+
+        if self.real is not None:
+            self.real.remove()
+            self.real = None
+        self.sinks = [(sink, level) for sink, level in sinks if level and level != OFF]
+        self.level = min((LEVELS[level] for _, level in self.sinks),
+                         default=LEVELS['CRITICAL'] + 1)
+
+    def enabled(self, level: str) -> bool:
+        """some sink takes messages of level"""
+
+        return LEVELS[level] >= self.level
+
+    def loguru(self):
+        """loguru's logger with the sinks of setup(), imported on first use"""
+
+        if self.real is None:
+            from loguru import logger
+            if self.sinks is not None:
+                logger.remove()
+                for sink, level in self.sinks:
+                    logger.add(sink, level=level)
+            self.real = logger
+        return self.real
+
+    # depth=1: loguru tells the caller of these, not them
+
+    def log(self, level: str, message: str) -> None:
+        if LEVELS[level] >= self.level:
+            self.loguru().opt(depth=1).log(level, message)
+
+    def debug(self, message: str) -> None:
+        if LEVELS['DEBUG'] >= self.level:
+            self.loguru().opt(depth=1).debug(message)
+
+    def info(self, message: str) -> None:
+        if LEVELS['INFO'] >= self.level:
+            self.loguru().opt(depth=1).info(message)
+
+    def success(self, message: str) -> None:
+        if LEVELS['SUCCESS'] >= self.level:
+            self.loguru().opt(depth=1).success(message)
+
+    def warning(self, message: str) -> None:
+        if LEVELS['WARNING'] >= self.level:
+            self.loguru().opt(depth=1).warning(message)
+
+    def error(self, message: str) -> None:
+        if LEVELS['ERROR'] >= self.level:
+            self.loguru().opt(depth=1).error(message)
+
+logger = Logger()
+
+def setup(*sinks) -> None:
+    """log to sinks: pairs (sink, level); with none, log nothing"""
+
+    logger.setup(*sinks)
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmobj, кодофайлы: чтение через mmap, секции (формат 13)
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# format 13
+#
+#  0  4   'SM13'
+#  4  2   header length, bytes, with the section table
+#  6  1   number of sections
+#  7  1   flags, 0
+#  8  12  each section: name (4 ascii), offset (4), length (4)
+#  ..     sections, in the order of the table
+#  -4 4   CRC32 of everything before it
+#
+# Sections:
+#  CODE - codes; addresses in operands are from the start of CODE
+#  DATA - pool of strings, each is a length byte and chars;
+#         code 72 (string) has a 3 byte offset into DATA
+#  SYMS - labels: name length (2), name (utf-8), address (3);
+#         not needed to run, for ksmd and for people
+#
+# Numbers are big-endian, as everywhere in code files.
+# Unknown sections are skipped, so new ones may be added later.
+
+# --------------------------------------------------------------
+# imports
+
+import sys
+import mmap
+import zlib
+
+# --------------------------------------------------------------
+# setup
+
+MAGIC = b'SM13'
+
+SECTIONS = ('CODE', 'DATA', 'SYMS')     # in the order they are written
+
+ENTRY = 12          # length of a section table entry
+CRCLEN = 4          # length of CRC32 at the end
+ADDRLEN = 3         # length of an address in SYMS
+
+CHUNK = 1 << 16     # bytes summed at a time by checksum()
+
+class FormatError(Exception):
+    """code file of format 13 is broken"""
+
+# --------------------------------------------------------------
+# code files of any format
+
+def map_file(path: str) -> mmap.mmap | bytes:
+    """code file at path mapped into memory, read only: pages are read
+    when used and shared by all processes that map the same file
+    """
+
+    with open(path, 'rb') as infile:
+        try:
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file, can not be mapped
+            return b''
+
+def checksum(cf) -> int:
+    """checksum of formats 11, 12: sum of all bytes but the last, modulo 256;
+    taken in chunks, so cf is never copied whole
+    """
+
+    view = memoryview(cf)
+    end = len(view) - 1
+    total = 0
+    for i in range(0, end, CHUNK):
+        total += sum(view[i:min(i + CHUNK, end)].tobytes())
+    return total % 256
+
+# --------------------------------------------------------------
+# write
+
+def symbols(labels: dict[str, int]) -> bytes:
+    """SYMS section from labels: name -> address"""
+
+    syms = bytearray()
+    for name, a in sorted(labels.items(), key=lambda item: (item[1], item[0])):
+        b = name.encode('utf-8')
+        syms.extend(len(b).to_bytes(2))
+        syms.extend(b)
+        syms.extend(a.to_bytes(ADDRLEN))
+    return bytes(syms)
+
+def pack(code: bytes, data: bytes = b'', labels: dict[str, int] | None = None) -> bytes:
+    """code file of format 13 from code, string pool and labels"""
+
+    sections = {'CODE': code, 'DATA': data, 'SYMS': symbols(labels or {})}
+
+    headlen = 8 + ENTRY * len(sections)
+    head = bytearray(MAGIC)
+    head.extend(headlen.to_bytes(2))
+    head.append(len(sections))
+    head.append(0)
+
+    offset = headlen
+    for name in SECTIONS:
+        head.extend(name.encode('ascii'))
+        head.extend(offset.to_bytes(4))
+        head.extend(len(sections[name]).to_bytes(4))
+        offset += len(sections[name])
+
+    cf = head
+    for name in SECTIONS:
+        cf.extend(sections[name])
+    cf.extend(zlib.crc32(cf).to_bytes(CRCLEN))
+    return bytes(cf)
+
+# --------------------------------------------------------------
+# read
+
+def unpack(cf) -> dict[str, memoryview]:
+    """sections of code file cf of format 13 (bytes, bytearray, mmap)
+    as memoryviews into cf, no copying; raise FormatError if it is broken
+    """
+
+    view = memoryview(cf)
+    size = len(view)
+
+    if size < 8 + CRCLEN or view[:4] != MAGIC:
+        raise FormatError("The file read is not a binary from Stack Machine of version 13.")
+
+    if zlib.crc32(view[:-CRCLEN]) != int.from_bytes(view[-CRCLEN:]):
+        raise FormatError("Bad code file checksum.")
+
+    headlen = int.from_bytes(view[4:6])
+    count = view[6]
+    if headlen < 8 + ENTRY * count or headlen > size - CRCLEN:
+        raise FormatError(f"Bad code file header: {headlen=}, {count=}")
+
+    sections = {}
+    for i in range(count):
+        entry = view[8 + ENTRY * i : 8 + ENTRY * (i + 1)]
+        name = bytes(entry[:4]).decode('ascii', errors='replace')
+        offset = int.from_bytes(entry[4:8])
+        length = int.from_bytes(entry[8:12])
+        if offset < headlen or offset + length > size - CRCLEN:
+            raise FormatError(f"Bad section {name}: {offset=}, {length=}")
+        sections[name] = view[offset : offset + length]
+
+    if 'CODE' not in sections:
+        raise FormatError("No code in code file.")
+    sections.setdefault('DATA', view[0:0])
+    sections.setdefault('SYMS', view[0:0])
+    return sections
+
+def labels(syms) -> dict[str, int]:
+    """labels from SYMS section: name -> address"""
+
+    found = {}
+    i = 0
+    while i < len(syms):
+        n = int.from_bytes(syms[i:i+2])
+        name = bytes(syms[i+2:i+2+n]).decode('utf-8')
+        i += 2 + n
+        found[name] = int.from_bytes(syms[i:i+ADDRLEN])
+        i += ADDRLEN
+    return found
+
+# --------------------------------------------------------------
+# show a code file
+
+if __name__ == '__main__':
+    inname = sys.argv[1] if len(sys.argv) > 1 else 'prog01.smb'
+    sections = unpack(map_file(inname))
+    for name, part in sections.items():
+        print(f"{name} {len(part):8} bytes")
+    for name, a in labels(sections['SYMS']).items():
+        print(f"{a:06} {name}")
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
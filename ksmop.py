@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmop, таблица кодов машины, общая для всех программ
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# imports
+
+import os
+import importlib.util
+
+# --------------------------------------------------------------
+# table file, next to this file and not in the current directory;
+# its cache, in the user's cache directory as ksmc's compiled code,
+# as the install may be read-only
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+OPCODES_PATH = os.path.join(HERE, 'opcodes.tsv')        # table of codes
+CACHE_DIR    = os.path.join(os.path.expanduser('~'), '.cache', 'ksm')
+CACHE_PATH   = os.path.join(CACHE_DIR, 'ksmop_table.py')   # same, made into python
+
+# --------------------------------------------------------------
+# read the table
+
+def parse(path: str = OPCODES_PATH) -> tuple[list[tuple], str]:
+    """read table of codes: list of (code, name, bytes, description),
+    and sha256 of the file, to tell versions of the table apart
+    """
+
+    import hashlib      # only when the cache is old, not on every start
+
+    with open(path, 'rb') as codesfile:
+        data = codesfile.read()
+
+    codes = []
+    lines = data.decode('utf-8').splitlines()
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        c, n, b, d = line.strip().split('\t', maxsplit=3)
+        codes.append((int(c), n, int(b), d))
+
+    return codes, hashlib.sha256(data).hexdigest()
+
+def write_cache(codes: list[tuple], digest: str, stamp: tuple,
+                path: str = CACHE_PATH) -> None:
+    """save parsed table as a python module, if the directory allows;
+    written whole under another name, then renamed, so a process reading
+    it at the same time gets the old module or the new one
+    """
+
+    text = ("# made by ksmop.py from opcodes.tsv, do not edit\n"
+            f"STAMP = {stamp!r}\n"
+            f"DIGEST = {digest!r}\n"
+            f"CODES = {codes!r}\n")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wt') as cachefile:
+            cachefile.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def read_cache(stamp: tuple, path: str = CACHE_PATH) -> tuple[list[tuple], str] | None:
+    """parsed table from the python module, None if it is missing or old"""
+
+    if not os.path.exists(path):
+        return None
+    try:
+        spec = importlib.util.spec_from_file_location('_ksmop_table', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception:
+        return None
+    if getattr(module, 'STAMP', None) != stamp:
+        return None
+    return module.CODES, module.DIGEST
+
+def load(path: str = OPCODES_PATH, cache: bool = True) -> tuple[list[tuple], str]:
+    """table of codes and its digest, from the python cache when it is
+    as new as the table file, else parsed (and cached)
+    """
+
+    # the path too: installs in other places share the one cache
+    st = os.stat(path)
+    stamp = (path, st.st_mtime_ns, st.st_size)
+    if cache and path == OPCODES_PATH:
+        found = read_cache(stamp)
+        if found is not None:
+            return found
+    codes, digest = parse(path)
+    if cache and path == OPCODES_PATH:
+        write_cache(codes, digest, stamp)
+    return codes, digest
+
+# --------------------------------------------------------------
+# lookup tables, made once on import
+
+codes, digest = load()
+
+NAMES        = [None] * 256     # code -> name, None if no such code
+LENGTHS      = bytearray(256)   # code -> length in bytes with operand, 0 if no such code
+DESCRIPTIONS = [''] * 256       # code -> description
+name2code    = {}               # name -> code
+
+for c, n, b, d in codes:
+    NAMES[c] = n
+    LENGTHS[c] = b
+    DESCRIPTIONS[c] = d
+    name2code[n] = c
+
+NAMES = tuple(NAMES)
+LENGTHS = bytes(LENGTHS)
+DESCRIPTIONS = tuple(DESCRIPTIONS)
+
+# --------------------------------------------------------------
+# code file formats
+#
+# 11: addresses in operands are 2 bytes, code up to 64 KiB
+# 12: addresses are 3 bytes, code up to 16 MiB, and jumps and calls
+#     have short forms (code + SHORT) with one signed byte operand:
+#     the target relative to the next code
+# 13: as 12, in sections with a string pool and CRC32, see ksmobj;
+#     code 72 (string) has a 3 byte offset into the pool
+
+FORMATS = ('11', '12', '13')
+
+# formats with sections, strings are in the pool
+SECTIONED = frozenset({'13'})
+
+# codes with an address operand
+ADDR_CODES = frozenset({30, 31, 32, 33, 34, 35, 36, 37, 38, 40, 75, 80, 81})
+
+SHORT = 100
+
+# code -> its long form: short codes to the long ones, others to themselves
+BASE = bytes(c - SHORT if c >= SHORT and NAMES[c] is not None and c - SHORT in ADDR_CODES else c
+             for c in range(256))
+
+# short codes
+SHORT_CODES = frozenset(c for c in range(256) if BASE[c] != c)
+
+# format -> bytes of address operands, most code file length
+ADDR_BYTES = {'11': 2, '12': 3, '13': 3}
+CF_MAX     = {'11': 65535, '12': 256 ** 3 - 1, '13': 256 ** 3 - 1}
+
+def lengths(fmt: str) -> bytes:
+    """code -> length of code in bytes in format fmt, 0 if no such code"""
+
+    width = ADDR_BYTES[fmt]
+    pooled = {name2code['string']} if fmt in SECTIONED else set()
+    return bytes(1 + width if c in ADDR_CODES or c in pooled else LENGTHS[c]
+                 for c in range(256))
+
+LENGTHS_BY_FORMAT = {fmt: lengths(fmt) for fmt in FORMATS}
+
+# --------------------------------------------------------------
+# show the table
+
+if __name__ == '__main__':
+    print(f"{OPCODES_PATH}, sha256 {digest}\n")
+    for c, n, b, d in codes:
+        print(f"{c:3} ({c:02X}) {n:10} {b}  {d}")
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
@@ -16,35 +16,24 @@ version = '11'
 # imports
 
 import sys
-from loguru import logger
-from pprint import pp, pprint
+import time
+import zlib
+import argparse
+import itertools
+import functools
 import random
+from array import array
+from collections import defaultdict, deque
 
-# --------------------------------------------------------------
-# in/out file names
-
-if len(sys.argv) > 1:
-    inout = sys.argv[1]
-else:
-    inout = 'prog01'
-
-if len(inout) > 4 and inout[-4] == '.':
-    inout = inout[:-4]
-
-inname  = inout + '.smb'     # state machine program text
-logname = inout + '.sml'     # state machine program log
-outname = inout + '.smo'     # state machine program output
-
-logger.remove()
-logger.add(sys.stderr, level="WARNING")
-logger.add(logname, level="DEBUG")
-
-logger.info(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
+from ksmop import NAMES, BASE, ADDR_CODES, FORMATS, LENGTHS_BY_FORMAT, SECTIONED
+import ksmobj
+from ksmlog import logger, CHOICES
+import ksmlog
 
 # --------------------------------------------------------------
 # error level:
 # 0: print nothing, 1: only important, 2: all
-erlev = 2     
+erlev = 2
 
 # size of numbers
 UBYTEMOD = 256
@@ -58,7 +47,65 @@ MEMSIZE = 1024               # memory size
 # opcodes, special
 CODE_STOP    =  1
 CODE_END     = 2
+CODE_CALLD   = 40
 CODE_STRING  = 72
+CODE_NUMBER  = 74
+CODE_ADDR    = 75
+
+# opcodes with a label operand, resolved at load time
+BRANCH_CODES = {30, 31, 32, 33, 34, 35, 36, 37, 38, CODE_CALLD, 80, 81}
+
+# opcodes after which a new block of code starts
+BLOCK_END_CODES = BRANCH_CODES | {CODE_STOP, CODE_END, 41, 42}
+
+# stack effects of opcodes, checked once per block of code:
+# code: (DS elements needed, DS change, RS elements needed, RS change)
+# rot and over also check their DS0 operand themselves
+STACK_EFFECTS = {
+    10: (1, -1, 0, +1),     # dsrs
+    11: (0, +1, 1, -1),     # rsds
+    12: (1, +1, 0, 0),      # dup
+    13: (1, -1, 0, 0),      # drop
+    14: (2, -1, 0, 0),      # rot
+    15: (2, 0, 0, 0),       # over
+    16: (2, 0, 0, 0),       # swap
+    20: (1, 0, 0, 0),       # neg
+    21: (2, -1, 0, 0),      # add
+    22: (2, -1, 0, 0),      # sub
+    23: (2, -1, 0, 0),      # mul
+    24: (2, -1, 0, 0),      # div
+    25: (2, -1, 0, 0),      # mod
+    26: (1, 0, 0, 0),       # not
+    27: (0, +1, 0, 0),      # random
+    31: (1, -1, 0, 0),      # jeq
+    32: (1, -1, 0, 0),      # jne
+    33: (1, -1, 0, 0),      # jge
+    34: (1, -1, 0, 0),      # jgt
+    35: (1, -1, 0, 0),      # jle
+    36: (1, -1, 0, 0),      # jlt
+    40: (0, 0, 0, +1),      # calld
+    41: (1, -1, 0, +1),     # calli
+    42: (0, 0, 1, -1),      # return
+    50: (1, 0, 0, 0),       # fetch
+    51: (2, -2, 0, 0),      # store
+    60: (1, -1, 0, 0),      # printnum
+    61: (1, -1, 0, 0),      # printchar
+    66: (0, +1, 0, 0),      # inputnum
+    67: (0, +1, 0, 0),      # inputchar
+    68: (1, -1, 0, 0),      # printstr
+    70: (0, +1, 0, 0),      # char
+    71: (0, +1, 0, 0),      # space
+    72: (0, +1, 0, 0),      # string
+    73: (0, +1, 0, 0),      # byte
+    74: (0, +1, 0, 0),      # number
+    75: (0, +1, 0, 0),      # addr
+    80: (0, 0, 1, 0),       # jrz
+    81: (0, 0, 1, 0),       # djnz
+}
+
+# opcode classes for the profiler, by tens of codes
+OPCLASSES = ['control', 'stack', 'arith', 'jump', 'call',
+             'memory', 'io', 'literal', 'fused']
 
 # character codes
 CODE_SPACE   = 32
@@ -68,466 +115,1146 @@ CODE_SPACE   = 32
 DSlen   =   256     # data stack
 RSlen   =   256     # return stack
 Memlen  =  1024     # memory
-CFlen   = 65535     # code file 
+CFlen   = 65535     # code file
 CSlen   =   255     # control structures nesting
 
-# --------------------------------------------------------------
-# service functions
-
-def check_ds(n: int) -> None:
-    """check if DS has at least n elements and it not full"""
-    
-    assert len(ds) < DSlen, "DS overflow"
-    assert len(ds) >= n, "DS underflow"
-
-def check_rs(n: int) -> None:
-    """check if RS has at least n elements and it not full"""
-    
-    assert len(rs) < RSlen, "RS overflow"
-    assert len(rs) >= n, "RS underflow"
-
-def check_memory(a: int) -> None:
-    """check if address a is within memory size"""
-    
-    assert a >= 0, "Negatibe address"
-    assert a < Memlen, "Out of memory size"
+# snapshots of machine state
+SNAPSHOT_MAGIC = b'SMS1'
+STATES = ('ready', 'running', 'paused', 'stopped', 'error', 'blocked')
 
-# --------------------------------------------------------------
-# get data about machine codes
-
-codes = []
-
-## normal version, with tabs, checked + corrected
-codesname = 'opcodes.tsv'
-with open(codesname, 'rt') as codesfile:
-    line = codesfile.readline()
-    for line in codesfile.readlines():
-        c, n, b, d = line.strip().split('\t', maxsplit=3)
-        c = int(c)
-        b = int(b)
-        codes.append((c, n, b, d))
-# pprint(codes)
-
-code2name = {}
-for c, n, b, d in codes:
-    code2name[c] = {'code': c, 'name': n, 'bytes': b, 'description': d}
-# pprint(code2name)
+class LoadError(Exception):
+    """code file cannot be loaded into the machine"""
 
-# --------------------------------------------------------------
-# read file with program, decompile byte code if needed
+class Halt(Exception):
+    """program reached stop or end"""
 
-with open(inname, 'rb') as infile:
-    # print(f"Reading code file from {inname} ...", end=" ")
-    logger.info(f"Reading code file from {inname} ...", end=" ")
-    cf = infile.read()
-    # print("done.")
-    logger.info("done.")
+class MachineError(Exception):
+    """run time error: stack overflow or underflow, bad memory address"""
 
-# print(cf)
+class Blocked(Exception):
+    """program wants a line of input that is not there yet"""
 
 # --------------------------------------------------------------
-# check versions
+# program output
+
+class Output:
+    """where program output goes: stdout, a file, memory, or any of them
 
-if cf[:2] != 'SM'.encode('ascii'):
-    print('The file read is not a binary from Stack Machine.')
-    logger.error('The file read is not a binary from Stack Machine.')
-    raise SystemExit
+    Text is collected in a buffer and written out in one piece
+    when the buffer is full or on flush(), which the machine calls
+    when it stops, waits for input, or returns from run().
+    """
 
-if cf[2:4] != version.encode('ascii'):
-    print('The file read is from Stack Machine of wrong version.')
-    logger.error('The file read is from Stack Machine of wrong version.')
-    raise SystemExit
+    def __init__(self, stdout: bool = True, file=None, capture: bool = False,
+                 bufsize: int = 8192):
+        self.stdout = stdout        # write to sys.stdout
+        self.file = file            # write to this open text file
+        self.capture = capture      # keep all text, see getvalue()
+        self.bufsize = bufsize      # flush when this many chars collected
+        self.parts = []
+        self.size = 0
+        self.captured = []
+
+    def write(self, text: str) -> None:
+        """add text to output"""
+
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def flush(self) -> None:
+        """write collected text to all targets"""
+
+        if not self.parts:
+            return
+        text = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        if self.stdout:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if self.file is not None:
+            self.file.write(text)
+        if self.capture:
+            self.captured.append(text)
+
+    def getvalue(self) -> str:
+        """all text captured so far"""
+
+        self.flush()
+        return "".join(self.captured)
 
 # --------------------------------------------------------------
-# check checksum
+# program input
+
+class Input:
+    """where program input comes from: lines given to feed(), then,
+    if interactive, the terminal (input())
+
+    A machine that wants a line when there is none and the input is
+    not interactive is blocked: run() returns 'blocked' before the
+    input code, and the next run() tries it again.
+    """
+
+    def __init__(self, interactive: bool = True):
+        self.interactive = interactive  # ask the terminal when no lines are fed
+        self.lines = deque()
+
+    def feed(self, text: str) -> None:
+        """add lines of text for the program to read"""
+
+        self.lines.extend(text.splitlines())
+
+    def push(self, line: str) -> None:
+        """add one line, even an empty one"""
+
+        self.lines.append(line)
+
+    def ready(self) -> bool:
+        """a line can be read without blocking"""
 
-csum = sum(cf[:-1]) % 256
+        return bool(self.lines) or self.interactive
 
-assert csum == cf[-1], "Bad code file checksum."
+    def readline(self) -> str | None:
+        """next line, None if there is none yet"""
+
+        if self.lines:
+            return self.lines.popleft()
+        if self.interactive:
+            return input()
+        return None
 
 # --------------------------------------------------------------
-# prepare machine
+# profiler
+
+class Profiler:
+    """counts and times of codes executed, per address and per subroutine
+
+    The run loop adds one count and the time spent (ns) to the index
+    of each code executed, and tells the profiler about calls and
+    returns, so subroutines get call counts, inclusive codes and time,
+    and the codes done under each chain of calls (for flame graphs).
+    Times are of codes only, without the profiler's own work.
+    Inclusive numbers of a call are added when it returns.
+    """
+
+    def __init__(self, vm: 'VM'):
+        self.vm = vm
+        n = len(vm.prog)
+        self.counts = [0] * n        # codes executed, per index in prog
+        self.times = [0] * n         # ns spent, per index in prog
+
+        # 1 for calls, 2 for returns, 0 for other codes
+        cf = vm.cf
+        self.kinds = [0] * n
+        for ip in range(1, n - 1):
+            code = BASE[cf[vm.addrs[ip]]]
+            if code == CODE_CALLD or code == 41:
+                self.kinds[ip] = 1
+            elif code == 42:
+                self.kinds[ip] = 2
+
+        self.frames = []             # open calls: (address, start ns, start codes)
+        self.calls = {}              # address -> [calls, inclusive codes, inclusive ns]
+        self.stack = 'main'          # current chain of calls
+        self.stacks = defaultdict(int)       # chain of calls -> codes
+        self.stack_times = defaultdict(int)  # chain of calls -> ns
+        self.spent = 0               # ns spent in all codes
+        self.mark = (0, 0)           # codes and ns at the last call or return
+
+    def flush(self, steps: int, t: int) -> None:
+        """add codes and time since the last mark to the current chain of calls,
+        t is the time spent in codes so far
+        """
+
+        steps0, t0 = self.mark
+        self.stacks[self.stack] += steps - steps0
+        self.stack_times[self.stack] += t - t0
+        self.mark = (steps, t)
+
+    def event(self, kind: int, ip: int, steps: int, t: int) -> None:
+        """call (kind 1) to index ip, or return (kind 2)"""
+
+        self.flush(steps, t)
+
+        if kind == 1:
+            a = self.vm.addrs[ip]
+            self.frames.append((a, steps, t))
+            self.stack += f";sub_{a:04}"
+            self.calls.setdefault(a, [0, 0, 0])[0] += 1
+
+        elif self.frames:
+            a, steps0, t0 = self.frames.pop()
+            self.stack = self.stack.rsplit(';', 1)[0]
+            # recursive calls are counted once, by the outermost one
+            if all(f[0] != a for f in self.frames):
+                c = self.calls[a]
+                c[1] += steps - steps0
+                c[2] += t - t0
+
+    def to_dict(self) -> dict:
+        """all numbers collected, by code, class, address, subroutine and chain of calls"""
+
+        vm = self.vm
+        cf = vm.cf
+        opcodes = defaultdict(lambda: {'count': 0, 'ns': 0})
+        classes = defaultdict(lambda: {'count': 0, 'ns': 0})
+        addresses = []
 
-# reset code file to rebase addresses
-# cf = cf[4:]
+        for ip, count in enumerate(self.counts):
+            if not count:
+                continue
+            a = vm.addrs[ip]
+            code = cf[a] if a < vm.stop else CODE_END
+            name = NAMES[code] or '???'
+            ns = self.times[ip]
+            addresses.append({'addr': a, 'code': code, 'name': name, 'count': count, 'ns': ns})
+            for d in (opcodes[name], classes[OPCLASSES[BASE[code] // 10] if BASE[code] < 90 else 'other']):
+                d['count'] += count
+                d['ns'] += ns
 
-# run time data structures
+        return {
+            'codes': sum(self.counts),
+            'ns': sum(self.times),
+            'opcodes': dict(opcodes),
+            'classes': dict(classes),
+            'addresses': addresses,
+            'calls': [{'addr': a, 'calls': c[0], 'codes': c[1], 'ns': c[2]}
+                      for a, c in sorted(self.calls.items())],
+            'stacks': {k: {'codes': v, 'ns': self.stack_times[k]}
+                       for k, v in self.stacks.items() if v},
+        }
 
-ds = []    # data stack
-rs = []    # return stack
+    def collapsed(self) -> str:
+        """chains of calls with their codes, one per line, as flame graph tools read them"""
 
-# flags as operation results 
-flags = {'error': False, 
-         'overflow': False}
+        return "".join(f"{k} {v}\n" for k, v in self.stacks.items() if v)
 
-# memory
+    def report(self, top: int = 20) -> str:
+        """hot spots as text: by class, by code, by address, by subroutine"""
 
-memory = [0 for _ in range(MEMSIZE)]
+        d = self.to_dict()
+        codes = d['codes'] or 1
+        ns = d['ns'] or 1
 
-# make output
+        lines = [f"Profile: {d['codes']} codes, {d['ns'] / 1e6:.3f} ms in codes", ""]
 
-# print(f"Writing log text to {logname}.\n")
-logger.info(f"Writing log text to {logname}.")
+        def table(title, rows):
+            lines.append(f"{title:16} {'codes':>10} {'%':>6} {'ms':>10} {'%':>6} {'ns/code':>8}")
+            lines.append(f"{'-' * 16} {'-' * 10} {'-' * 6} {'-' * 10} {'-' * 6} {'-' * 8}")
+            for name, r in rows:
+                lines.append(f"{name:16} {r['count']:10} {r['count'] * 100 / codes:6.1f} "
+                             f"{r['ns'] / 1e6:10.3f} {r['ns'] * 100 / ns:6.1f} "
+                             f"{r['ns'] / r['count']:8.0f}")
+            lines.append("")
+
+        by_ns = lambda item: -item[1]['ns']
+        table('class', sorted(d['classes'].items(), key=by_ns))
+        table('code', sorted(d['opcodes'].items(), key=by_ns))
+
+        hot = sorted(d['addresses'], key=lambda r: -r['ns'])[:top]
+        table('address', [(f"{r['addr']:04} {r['name']}", r) for r in hot])
+
+        if d['calls']:
+            lines.append(f"{'subroutine':16} {'calls':>10} {'codes incl':>12} {'ms incl':>10} {'%':>6}")
+            lines.append(f"{'-' * 16} {'-' * 10} {'-' * 12} {'-' * 10} {'-' * 6}")
+            for r in sorted(d['calls'], key=lambda r: -r['ns']):
+                lines.append(f"{'sub_%04d' % r['addr']:16} {r['calls']:10} {r['codes']:12} "
+                             f"{r['ns'] / 1e6:10.3f} {r['ns'] * 100 / ns:6.1f}")
+            lines.append("")
+
+        return "\n".join(lines)
 
 # --------------------------------------------------------------
-# run the code
+# the machine
+
+class VM:
+    """stack machine: run time data structures and the byte code interpreter
+
+    One instance can load and run any number of programs in turn,
+    so a warm process pays the start up costs only once.
+
+    Loading decodes the byte code once into a list of (handler, operand)
+    pairs, with jump targets already turned into indexes of that list,
+    so the run loop only takes the next pair and calls the handler.
+    A handler returns the index to continue from, or None for the next one.
+    Index 0 stands for the file header and is never a jump target.
+
+    cf is the code: the whole file in formats 11 and 12 (code from
+    start to stop, then checksum), the CODE section in format 13;
+    data is where strings are: cf again, or the DATA section.
+    Sections are memoryviews into the file read, not copies.
+
+    Handlers do not check the stacks. Loading finds blocks of code
+    (from a jump target or a code after a jump up to the next jump)
+    and their stack needs, and the first code of each block checks
+    the stacks once for the whole block.
+    """
+
+    def __init__(self, out: Output | None = None, trace: bool = False,
+                 profile: bool = False, inp: Input | None = None):
+        self.out = out if out is not None else Output()     # program output
+        self.inp = inp if inp is not None else Input()      # program input
+        self.trace = trace       # log every code executed, slow
+        self.profile = profile   # count and time codes executed, see Profiler
+        self.write = self.write_traced if trace else self.out.write
+        self.file = b''          # code file as loaded
+        self.cf = b''            # code
+        self.data = b''          # strings
+        self.start = HEADLEN     # address of the first code in cf
+        self.stop = HEADLEN      # address after the last code in cf
+        self.format = version    # code file format, see ksmop.FORMATS
+        self.lengths = LENGTHS_BY_FORMAT[version]   # code -> length in this format
+
+        # dispatch table: code -> handler
+        self.table = [self.op_illegal] * 256
+        # short forms of jumps and calls run as the long ones
+        for code, name in enumerate(NAMES):
+            if name is not None:
+                self.table[code] = getattr(self, 'op_' + NAMES[BASE[code]])
+
+        self.prog = [(self.op_noop, 0), (self.op_end, HEADLEN)]  # decoded code: (handler, operand)
+        self.addrs = [0, HEADLEN]                                # decoded code: addresses in cf
+        self.addr2ip = {HEADLEN: 1}                              # address in cf -> index in prog
+        self.needs = [(0, 0, 0, 0)] * 2                          # decoded code: stack needs to block end
+        self.reset()
+
+    def reset(self) -> None:
+        """clear stacks, memory and flags, rewind to the start of code"""
+
+        # stacks and memory are arrays of machine words:
+        # compact, and the block checks keep stacks within DSlen, RSlen
+        self.ds = array('l')    # data stack
+        self.rs = array('l')    # return stack
 
-with open(outname, 'wt') as outfile:
+        # flags as operation results
+        self.flags = {'error': False,
+                      'overflow': False}
 
-    # print(f"Files: {inout=}, {inname=}, {outname=}, {logname=}", file=outfile)
+        # memory
+        self.memory = array('l', [0]) * MEMSIZE
 
-    # icode = -1
-    icode = HEADLEN - 1
+        self.ip = 1                 # index of the next code in prog
+        self.steps = 0              # codes executed since reset
+        self.state = 'ready'        # ready, paused, blocked, stopped, error
+        self.error = None           # error message, if state is error
+        self.profiler = Profiler(self) if self.profile else None
 
-    try:
+    def load(self, cf) -> None:
+        """check code file cf (bytes, or mmap, see load_file)
+        and make it the current program; cf is not copied
+        """
 
-        while icode < len(cf):
-            icode += 1
-            
+        cf = memoryview(cf)
+        self.file = cf
+
+        # check versions
+
+        if cf[:2] != 'SM'.encode('ascii'):
+            raise LoadError('The file read is not a binary from Stack Machine.')
+
+        fmt = bytes(cf[2:4]).decode('ascii', errors='replace')
+        if fmt not in FORMATS:
+            raise LoadError('The file read is from Stack Machine of wrong version.')
+
+        if fmt in SECTIONED:
+            try:
+                sections = ksmobj.unpack(cf)
+            except ksmobj.FormatError as e:
+                raise LoadError(str(e)) from None
+            code = sections['CODE']
+            self.cf = code
+            self.data = sections['DATA']
+            self.start = 0
+            self.stop = len(code)
+
+        else:
+            # check checksum
+
+            if len(cf) < 1 or ksmobj.checksum(cf) != cf[-1]:
+                raise LoadError("Bad code file checksum.")
+
+            self.cf = cf
+            self.data = cf
+            self.start = HEADLEN
+            self.stop = len(cf) - 1     # checksum is not code
+
+        self.format = fmt
+        self.lengths = LENGTHS_BY_FORMAT[fmt]
+        self.decode()
+        self.reset()
+
+    def load_file(self, path: str) -> None:
+        """load code file at path, mapped into memory and not read whole"""
+
+        self.load(ksmobj.map_file(path))
+
+    # ----------------------------------------------------------
+    # snapshots
+
+    def snapshot(self, code: bool = True) -> bytes:
+        """machine state as bytes: where it is, steps done, state, flags,
+        stacks and memory, and the code file unless code is False
+        (then restore() needs the same program loaded); output sent
+        so far is not in it. Numbers are big-endian, words 8 bytes,
+        CRC32 at the end.
+        """
+
+        def words(a: array) -> bytes:
+            q = array('q', a)
+            if sys.byteorder == 'little':
+                q.byteswap()
+            return len(q).to_bytes(4) + q.tobytes()
+
+        error = (self.error or '').encode('utf-8')
+        flags = self.flags
+
+        snap = bytearray(SNAPSHOT_MAGIC)
+        snap.append(1 if code else 0)
+        snap.extend(zlib.crc32(self.file).to_bytes(4))
+        if code:
+            snap.extend(len(self.file).to_bytes(4))
+            snap.extend(self.file)
+        snap.extend(self.addrs[self.ip].to_bytes(4))
+        snap.extend(self.steps.to_bytes(8))
+        snap.append(STATES.index(self.state))
+        snap.append(flags['error'] | flags['overflow'] << 1)
+        snap.extend(len(error).to_bytes(2))
+        snap.extend(error)
+        snap.extend(words(self.ds))
+        snap.extend(words(self.rs))
+        snap.extend(words(self.memory))
+        snap.extend(zlib.crc32(snap).to_bytes(4))
+        return bytes(snap)
+
+    def restore(self, snap: bytes) -> None:
+        """put the machine in the state saved by snapshot(); the code
+        is loaded from the snapshot, if it is not loaded already
+        """
+
+        view = memoryview(snap)
+        if len(view) < 8 or view[:4] != SNAPSHOT_MAGIC:
+            raise LoadError("Not a snapshot of Stack Machine.")
+        if zlib.crc32(view[:-4]) != int.from_bytes(view[-4:]):
+            raise LoadError("Bad snapshot checksum.")
+
+        i = 4
+        def take(n: int) -> memoryview:
+            nonlocal i
+            if i + n > len(view) - 4:
+                raise LoadError("Snapshot cut short.")
+            i += n
+            return view[i-n:i]
+
+        def words() -> array:
+            n = int.from_bytes(take(4))
+            q = array('q')
+            q.frombytes(take(8 * n))
+            if sys.byteorder == 'little':
+                q.byteswap()
+            try:
+                return array('l', q)
+            except OverflowError:
+                raise LoadError("Snapshot numbers do not fit machine words.") from None
+
+        has_code = take(1)[0]
+        crc = int.from_bytes(take(4))
+        if has_code:
+            code = take(int.from_bytes(take(4)))
+            if zlib.crc32(self.file) != crc:
+                self.load(code)
+        elif zlib.crc32(self.file) != crc:
+            raise LoadError("Snapshot is of another program.")
+
+        addr = int.from_bytes(take(4))
+        steps = int.from_bytes(take(8))
+        state = take(1)[0]
+        flags = take(1)[0]
+        error = bytes(take(int.from_bytes(take(2)))).decode('utf-8')
+        ds, rs, memory = words(), words(), words()
+
+        if (addr not in self.addr2ip or state >= len(STATES) or len(memory) != MEMSIZE
+                or len(ds) > DSlen or len(rs) > RSlen):
+            raise LoadError("Bad snapshot.")
+
+        self.reset()
+        self.ip = self.addr2ip[addr]
+        self.steps = steps
+        self.state = STATES[state]
+        self.flags['error'] = bool(flags & 1)
+        self.flags['overflow'] = bool(flags & 2)
+        self.error = error or None
+        self.ds = ds
+        self.rs = rs
+        self.memory = memory
+
+    def decode(self) -> None:
+        """decode cf into prog: handlers with ready operands"""
+
+        cf = self.cf
+        table = self.table
+        lengths = self.lengths
+        inline = self.format not in SECTIONED
+        prog = [(self.op_noop, 0)]     # header
+        addrs = [0]
+        addr2ip = {}
+        branches = []                  # indexes of codes with a label operand
+        leaders = {self.start}         # addresses where blocks of code start
+
+        # pass 1: split code into instructions, decode operands
+
+        icode = self.start
+        last = self.stop
+
+        while icode < last:
             code = cf[icode]
-            
-            # show opname
-            opname = code2name[code]['name']
-            oplen = code2name[code]['bytes']
-            
+            base = BASE[code]           # long form of a short jump or call
+            addr2ip[icode] = len(prog)
+            addrs.append(icode)
+            oplen = lengths[code] or 1
+
+            if icode + oplen > last:
+                raise LoadError(f"Code cut short: {code=} @ {icode=}")
+
             match oplen:
-                case 1:
-                    # print(f"{icode:04} {code:02} ({code:02X}) {opname:10}")
-                    logger.info(f"{icode:04} {code:02} ({code:02X}) {opname:10}")
-                    
+                case 2 if code != base:
+                    # short: signed byte, from the next code
+                    d = cf[icode+1]
+                    arg = icode + 2 + (d - 256 if d >= 128 else d)
                 case 2:
-                    # print(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4}")
-                    logger.info(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4}")
-                    # icode += 1
-                    
+                    arg = cf[icode+1]
+                case _ if base in ADDR_CODES:
+                    arg = int.from_bytes(cf[icode+1:icode+oplen])
+                case _ if code == CODE_STRING and inline:
+                    # string follows
+                    arg = icode + 1
+                case _ if code == CODE_STRING:
+                    # string in pool
+                    arg = int.from_bytes(cf[icode+1:icode+oplen])
+                    if arg >= len(self.data):
+                        raise LoadError(f"Bad string {arg} @ {icode=}")
                 case 3:
                     x1 = cf[icode+1]
                     x2 = cf[icode+2]
-                    s = x1 & 128
-                    x1 &= 127
-                    x = x1 * 256 + x2
-                    x *= -1 if s else 1
-                                    
-                    # print(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4} {cf[icode+2]:4} ({x})")
-                    logger.info(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4} {cf[icode+2]:4} ({x})")
-                    # icode += 2
-                    
-                case _:
-                    # print("???")
-                    logger.error("???")
-                    
-            # print(f"{icode=}, {ds=}, {rs=}")
-            logger.info(f"{icode=}, {ds=}, {rs=}")
-                    
-            match code:
-                case 0: # 0   noop    1   no actions
-                    pass
-                    
-                case 1: # 1   stop    1   stop program
-                    pass
-                    
-                case 2: # 2   end 1   end of code
-                    pass
-                    
-                case 12: # 12  dup 1   copy DS
-                    check_ds(1)
-                    ds.append(ds[-1])
-                    
-                case 13: # 13  drop    1    drop DS
-                    check_ds(1)
-                    ds.pop()
-                    
-                case 14: # 14  rot 1   move DS0@ to DS
-                    check_ds(2)
-                    n = ds.pop()
-                    ds = ds[:-n] + ds[-n+1:] + [ds[-n]]
-                    
-                case 15: # 15  over    1    DS0@ to DS
-                    check_ds(2)
-                    n = ds.pop()
-                    ds.append(ds[-n])
-                    
-                case 16: # 16  swap    1    swap DS1, DS0
-                    check_ds(2)
-                    ds[-2], ds[-1] = ds[-1], ds[-2]
-                    
-                case 10: # 10  dsrs    1    move DS0 to RS0
-                    check_ds(1)
-                    rs.append(ds.pop())
-                    
-                case 11: # 11  rsds    1    move RS0 to DS0
-                    check_rs(1)
-                    ds.append(rs.pop())
-                    
-                case 20: # 20  neg 1   change sign of DS0
-                    check_ds(1)
-                    ds[-1] *= -1
-                    
-                case 21: # 21  add 1   DS1 + DS0
-                    check_ds(2)
-                    flags['overflow'] = False
-                    x = (ds.pop() + ds.pop()) % 65636
-                    if -SNUMMOD < x or x > SNUMMOD:
-                        flags['overflow'] = True
-                    ds.append(x) 
-                    
-                case 22: # 22  sub 1   DS1 - DS0
-                    check_ds(2)
-                    flags['overflow'] = False
-                    x = (- ds.pop() + ds.pop()) % 65636
-                    if -SNUMMOD < x or x > SNUMMOD:
-                        flags['overflow'] = True
-                    ds.append(x)
-                    
-                case 23: # 23  mul 1   DS1 * DS0
-                    check_ds(2)
-                    flags['overflow'] = False
-                    x = (ds.pop() * ds.pop()) % 65636
-                    if -SNUMMOD < x or x > SNUMMOD:
-                        flags['overflow'] = True
-                    ds.append(x)
-                    
-                case 24: # 24  div 1   DS1 / DS0
-                    check_ds(2)
-                    flags['overflow'] = False
-                    flags['error'] = False
-                    x2 = ds.pop()
-                    x1 = ds.pop()
-                    if x2 == 0:
-                        flags['error'] = True
-                        ds.append(0)
-                    else:
-                        x = (x1 // x2) % 65636
-                        if -SNUMMOD < x or x > SNUMMOD:
-                            flags['overflow'] = True
-                        ds.append(x)
-                    
-                case 25: # 25  mod 1   DS1 % DS0
-                    check_ds(2)
-                    flags['overflow'] = False
-                    x2 = ds.pop()
-                    x1 = ds.pop()
-                    if x2 == 0:
-                        flags['error'] = True
-                        ds.append(0)
-                    else:
-                        x = (x1 % x2) % 65636
-                        if -SNUMMOD < x or x > SNUMMOD:
-                            flags['overflow'] = True
-                        ds.append(x)
-                    
-                case 26: # 26  not 1   negate !DS0
-                    check_ds(1)
-                    ds.append( 1 if ds.pop() == 0 else 1)
-                    
-                case 27: # 27	random	1	random number to DS0
-                    ds.append( random.randint(0, 65535) )
-                    
-                case 30: # 30  jump    3   goto label
-                    x = cf[icode+1] * 256 + cf[icode+2]
-                    icode = x - 1
-                                    
-                case 31: # 31  jeq 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() == 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 32: # 32  jne 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() != 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 33: # 33  jge 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() >= 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 34: # 34  jgt 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() > 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
+                    if code == CODE_NUMBER:
+                        s = x1 & 128
+                        x1 &= 127
+                        arg = x1 * 256 + x2
+                        arg *= -1 if s else 1
                     else:
-                        icode += 2
-                    
-                case 35: # 35  jle 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() <= 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 36: # 36  jlt 3   jump if DS0 == 0
-                    check_ds(1)
-                    if ds.pop() < 0:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 37: # 37  jof 3   jump if DS0 == 0
-                    if flags['overflow']:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 38: # 38  jef 3   jump if DS0 == 0
-                    if flags['error']:
-                        x = cf[icode+1] * 256 + cf[icode+2]
-                        icode = x - 1
-                    else:
-                        icode += 2
-                    
-                case 40: # 40  calld    3   call subroutine directly by label
-                    rs.append(icode+3)
-                    x = cf[icode+1] * 256 + cf[icode+2]
-                    icode = x - 1
-                    # print(f"{ds=}, {rs=}")
-                    
-                case 41: # 41  calli  1   call subroutine indirectly from DS0
-                    check_ds(1)
-                    rs.append(icode+1)
-                    icode = ds.pop() - 1
-                    
-                case 42: # 42  return  1   return from subroutine
-                    check_rs(1)
-                    icode = rs.pop() - 1
-                    
-                case 50: # 50  fetch   2   get value from memory
-                    check_ds(1)
-                    a = ds.pop()
-                    check_memory(a)
-                    ds.append( memory[a])
-                    
-                case 51: # 51  store   2   put value to memory
-                    check_ds(2)
-                    a = ds.pop()
-                    v = ds.pop()
-                    check_memory(a)
-                    memory[a] = v
-                    
-                case 60: # 60  printnum    1   print number
-                    check_ds(1)
-                    x = ds.pop()
-                    print(x, end=" ")
-                    print(x, end=" ", file=outfile)
-                    logger.success("output: " + str(x))
-                    
-                case 61: # 61  printchar   1   print character
-                    check_ds(1)
-                    x = chr(ds.pop())
-                    print(x, end="")
-                    print(x, end="", file=outfile)
-                    logger.success(str(x))
-                    
-                case 62: # 62  println 1   print newline
-                    print()
-                    print(file=outfile)
-                    logger.success("")
-                    
-                case 63: # 63  show    1   show system data
-                    print(f"show: {ds=}, {rs=}, {icode=}, {flags=}")
-                    print(f"show: {ds=}, {rs=}, {icode=}, {flags=}", file=outfile)
-                    logger.success(f"show: {ds=}, {rs=}, {icode=}, {flags=}")
-                    
-                case 64: # 64  dump    1   dump system data
-                    print(f"dump: {ds=}, {rs=}, {icode=}, {flags=}")
-                    print(f"dump: {ds=}, {rs=}, {icode=}, {flags=}", file=outfile)
-                    logger.success(f"dump: {ds=}, {rs=}, {icode=}, {flags=}")
-                    print(f"{memory=}")
-                    print(f"{memory=}", file=outfile)
-                    logger.success(f"{memory=}")
-                    
-                case 65: # 65  wait   1    wait for enter key
-                    input()
-                    
-                case 66: # 66  inputnum   1   wait for user input, get number
-                    check_ds(0)
-                    ds.append(int(input()))
-                    
-                case 67: # 67  inputchar   1   wait for user input, get character
-                    check_ds(0)
-                    ds.append(ord(input()[0]))
-                    
-                case 68: # 68  printstr    1   print string from DS0
-                    check_ds(1)
-                    x = ds.pop()
-                    y = cf[x]
-                    sout = ""
-                    for ic in range(x+1, x+y+1):
-                        ch = cf[ic]
-                        sout += chr(ch)
-                    print(sout, end="")
-                    print(sout, end="", file=outfile)
-                    logger.success(sout)
-                    
-                case 70: # 70  char    2   put char code to DS0
-                    check_ds(0)
-                    ds.append(cf[icode+1])
-                    icode += 1
-                    
-                case 71: # 71  space   1   put space code to DS0
-                    check_ds(0)
-                    ds.append(CODE_SPACE)
-                    
-                case 72: # 72  string  1   put Hollerith string address to DS0
-                    check_ds(0)
-                    ds.append(icode+1)
-                    icode += cf[icode+1] + 1
-
-                case 73: # 10  byte    2   load number 0.255 to DS
-                    check_ds(0)
-                    ds.append(cf[icode+1])
-                    icode += 1
-                    
-                case 74: # 11  number  3   load number -32768..32767
-                    check_ds(0)
-                    x1 = cf[icode+1]
-                    x2 = cf[icode+2]
-                    s = x1 & 128
-                    x1 &= 127
-                    x = x1 * 256 + x2
-                    x *= -1 if s else 1
-                    ds.append( x )
-                    icode += 2
-
-                case 75: # 75  addr   3   load address 0.65536 to DS
-                    check_ds(0)
-                    x1 = cf[icode+1]
-                    x2 = cf[icode+2]
-                    x = x1 * 256 + x2
-                    ds.append( x )
-                    icode += 2
-                    
+                        arg = x1 * 256 + x2
                 case _:
-                    print(f"\nValue error: illegal code {cf[icode]=} @ {icode=}, {ds=}, {rs=}")
-                    print(f"\nValue error: illegal code {cf[icode]=} @ {icode=}, {ds=}, {rs=}", file=outfile)
-                    logger.error(f"Value error: illegal code {cf[icode]=} @ {icode=}, {ds=}, {rs=}")
-                    raise ValueError
-            
-            if code == CODE_STOP or code == CODE_END:   # stop, end
-                break
-        
-    except AssertionError as e:
-        print(f"Assertion failed: {e}")
-        print(f"Assertion failed: {e}", file=outfile)
-        logger.error(f"Assertion failed: {e}")
-                
-# print("\nJob done.\n")
-print()
-print()
-logger.info("Job done.")
+                    arg = icode
+
+            if base in BRANCH_CODES:
+                branches.append(len(prog))
+            prog.append((table[code], arg))
+
+            if code == CODE_STRING and inline:
+                oplen += cf[icode+1] + 1
+            icode += oplen
+
+            if base in BRANCH_CODES or base == CODE_ADDR:
+                leaders.add(arg)
+            if base in BLOCK_END_CODES:
+                leaders.add(icode)
+
+        # running off the end of code stops the machine
+        addr2ip[icode] = len(prog)
+        addrs.append(icode)
+        prog.append((self.op_end, icode))
+
+        # pass 2: resolve jump targets to indexes in prog
+
+        for ip in branches:
+            handler, arg = prog[ip]
+            if arg not in addr2ip:
+                raise LoadError(f"Bad jump target {arg} @ {addrs[ip]}")
+            if BASE[cf[addrs[ip]]] == CODE_CALLD:
+                arg = (addr2ip[arg], addrs[ip+1])
+            else:
+                arg = addr2ip[arg]
+            prog[ip] = (handler, arg)
+
+        # pass 3: stack needs from each code to the end of its block,
+        # going backwards: (DS min depth, DS max growth, RS min, RS max)
+
+        needs = [(0, 0, 0, 0)] * len(prog)
+        after = (0, 0, 0, 0)
+        for ip in range(len(prog) - 1, 0, -1):
+            icode = addrs[ip]
+            code = BASE[cf[icode]] if icode < last else CODE_END
+            if code in BLOCK_END_CODES or addrs[ip+1] in leaders:
+                after = (0, 0, 0, 0)
+            ds_need, ds_delta, rs_need, rs_delta = STACK_EFFECTS.get(code, (0, 0, 0, 0))
+            ds_min, ds_max, rs_min, rs_max = after
+            after = (max(ds_need, ds_min - ds_delta), max(0, ds_max + ds_delta),
+                     max(rs_need, rs_min - rs_delta), max(0, rs_max + rs_delta))
+            needs[ip] = after
+
+        # checks go to the first code of each block
+
+        for ip in range(1, len(prog)):
+            if addrs[ip] in leaders and needs[ip] != (0, 0, 0, 0):
+                handler, arg = prog[ip]
+                prog[ip] = (functools.partial(self.op_checked, needs[ip], handler), arg)
+
+        self.prog = prog
+        self.addrs = addrs
+        self.addr2ip = addr2ip
+        self.needs = needs
+
+    # ----------------------------------------------------------
+    # service functions
+
+    def check(self, need: tuple) -> None:
+        """check stacks against needs of a block of code:
+        DS and RS have enough elements and do not get full
+        """
+
+        ds_min, ds_max, rs_min, rs_max = need
+        n = len(self.ds)
+        if n + ds_max >= DSlen:
+            raise MachineError("DS overflow")
+        if n < ds_min:
+            raise MachineError("DS underflow")
+        n = len(self.rs)
+        if n + rs_max >= RSlen:
+            raise MachineError("RS overflow")
+        if n < rs_min:
+            raise MachineError("RS underflow")
+
+    def op_checked(self, need: tuple, handler, arg):
+        """check stacks for the block starting here, then run its first code"""
+
+        self.check(need)
+        return handler(arg)
+
+    def goto(self, a: int) -> int:
+        """index in prog to continue from address a, for indirect calls and returns"""
+
+        if a not in self.addr2ip:
+            raise ValueError(f"illegal address {a}")
+        ip = self.addr2ip[a]
+        self.check(self.needs[ip])
+        return ip
+
+    def readline(self) -> str:
+        """line of program input, raise Blocked if there is none yet"""
+
+        self.out.flush()
+        line = self.inp.readline()
+        if line is None:
+            raise Blocked
+        return line
+
+    def write_traced(self, text: str) -> None:
+        """send text to program output and note it in log"""
+
+        self.out.write(text)
+        logger.success(text)
+
+    def trace_code(self, icode: int) -> None:
+        """log code at address icode and the stacks before it runs"""
+
+        cf = self.cf
+        code = cf[icode] if icode < self.stop else CODE_END
+
+        opname = NAMES[code]
+        oplen = self.lengths[code]
+        if opname is None:
+            return
+
+        match oplen:
+            case 1:
+                logger.info(f"{icode:04} {code:02} ({code:02X}) {opname:10}")
+
+            case 2 if code != BASE[code]:
+                d = cf[icode+1]
+                x = icode + 2 + (d - 256 if d >= 128 else d)
+                logger.info(f"{icode:04} {code:02} {opname:10} {d:4} ({x})")
+
+            case _ if BASE[code] in ADDR_CODES:
+                x = int.from_bytes(cf[icode+1:icode+oplen])
+                logger.info(f"{icode:04} {code:02} {opname:10} ({x})")
+
+            case _ if code == CODE_STRING:
+                x = int.from_bytes(cf[icode+1:icode+oplen])
+                data = self.data
+                logger.info(f"{icode:04} {code:02} {opname:10} ({x}) {str(data[x+1:x+1+data[x]], 'latin-1')!r}")
+
+            case 2:
+                logger.info(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4}")
+
+            case 3:
+                x1 = cf[icode+1]
+                x2 = cf[icode+2]
+                s = x1 & 128
+                x1 &= 127
+                x = x1 * 256 + x2
+                x *= -1 if s else 1
+
+                logger.info(f"{icode:04} {code:02} {opname:10} {cf[icode+1]:4} {cf[icode+2]:4} ({x})")
+
+            case _:
+                logger.error("???")
+
+        logger.info(f"{icode=}, ds={self.ds.tolist()}, rs={self.rs.tolist()}")
+
+    # ----------------------------------------------------------
+    # run the code
+
+    def run(self, max_steps: int | None = None) -> str:
+        """run loaded program until it stops or max_steps codes are done,
+        return the machine state
+        """
+
+        if self.state in ('stopped', 'error'):
+            return self.state
+
+        prog = self.prog
+        addrs = self.addrs
+        trace_code = self.trace_code
+        profiler = self.profiler
+        spent = profiler.spent if profiler is not None else 0
+
+        if max_steps is None:
+            counter = itertools.count(1)
+        else:
+            counter = range(1, max_steps + 1)
+
+        ip = self.ip
+        steps = 0
+        self.state = 'running'
+
+        try:
+
+            if self.trace:
+                for steps in counter:
+                    trace_code(addrs[ip])
+                    handler, arg = prog[ip]
+                    ip = handler(arg) or ip + 1
+
+            elif profiler is not None:
+                counts = profiler.counts
+                times = profiler.times
+                kinds = profiler.kinds
+                clock = time.perf_counter_ns
+                done = self.steps
+                for steps in counter:
+                    handler, arg = prog[ip]
+                    counts[ip] += 1
+                    t0 = clock()
+                    nip = handler(arg) or ip + 1
+                    t = clock() - t0
+                    times[ip] += t
+                    spent += t
+                    if kinds[ip]:
+                        profiler.event(kinds[ip], nip, done + steps, spent)
+                    ip = nip
+
+            else:
+                for steps in counter:
+                    handler, arg = prog[ip]
+                    ip = handler(arg) or ip + 1
+
+            self.state = 'paused'
+
+        except Halt:
+            self.state = 'stopped'
+
+        except Blocked:
+            # the input code did not run, it runs again next time
+            self.state = 'blocked'
+            steps -= 1
+            if profiler is not None:
+                profiler.counts[ip] -= 1
+
+        except MachineError as e:
+            self.state = 'error'
+            self.error = str(e)
+            self.out.write(f"Machine error: {e}\n")
+            logger.error(f"Machine error: {e}")
+
+        except (ValueError, OverflowError) as e:
+            self.state = 'error'
+            self.error = str(e)
+            self.out.write(f"\nValue error: {e}\n")
+            logger.error(f"Value error: {e}")
+
+        finally:
+            self.ip = ip
+            self.steps += steps
+            self.out.flush()
+            if profiler is not None:
+                profiler.spent = spent
+                profiler.flush(self.steps, spent)
+
+        return self.state
+
+    # ----------------------------------------------------------
+    # codes
+    # each handler gets the operand decoded at load time:
+    # a number, an index in prog for jumps, or its own address in cf
+
+    def op_illegal(self, icode):
+        raise ValueError(f"illegal code {self.cf[icode]} @ {icode=}, ds={self.ds.tolist()}, rs={self.rs.tolist()}")
+
+    def op_noop(self, arg): # 0   noop    1   no actions
+        pass
+
+    def op_stop(self, arg): # 1   stop    1   stop program
+        raise Halt
+
+    def op_end(self, arg): # 2   end 1   end of code
+        raise Halt
+
+    def op_dsrs(self, arg): # 10  dsrs    1    move DS0 to RS0
+        self.rs.append(self.ds.pop())
+
+    def op_rsds(self, arg): # 11  rsds    1    move RS0 to DS0
+        self.ds.append(self.rs.pop())
+
+    def op_dup(self, arg): # 12  dup 1   copy DS
+        ds = self.ds
+        ds.append(ds[-1])
+
+    def op_drop(self, arg): # 13  drop    1    drop DS
+        self.ds.pop()
+
+    def op_rot(self, arg): # 14  rot 1   move DS0@ to DS
+        ds = self.ds
+        n = ds.pop()
+        if not 0 < n <= len(ds):
+            raise MachineError("DS underflow")
+        ds.append(ds.pop(-n))
+
+    def op_over(self, arg): # 15  over    1    DS0@ to DS
+        ds = self.ds
+        n = ds.pop()
+        if not 0 < n <= len(ds):
+            raise MachineError("DS underflow")
+        ds.append(ds[-n])
+
+    def op_swap(self, arg): # 16  swap    1    swap DS1, DS0
+        ds = self.ds
+        ds[-2], ds[-1] = ds[-1], ds[-2]
+
+    def op_neg(self, arg): # 20  neg 1   change sign of DS0
+        self.ds[-1] *= -1
+
+    def op_add(self, arg): # 21  add 1   DS1 + DS0
+        ds = self.ds
+        flags = self.flags
+        flags['overflow'] = False
+        x = (ds.pop() + ds.pop()) % 65636
+        if -SNUMMOD < x or x > SNUMMOD:
+            flags['overflow'] = True
+        ds.append(x)
+
+    def op_sub(self, arg): # 22  sub 1   DS1 - DS0
+        ds = self.ds
+        flags = self.flags
+        flags['overflow'] = False
+        x = (- ds.pop() + ds.pop()) % 65636
+        if -SNUMMOD < x or x > SNUMMOD:
+            flags['overflow'] = True
+        ds.append(x)
+
+    def op_mul(self, arg): # 23  mul 1   DS1 * DS0
+        ds = self.ds
+        flags = self.flags
+        flags['overflow'] = False
+        x = (ds.pop() * ds.pop()) % 65636
+        if -SNUMMOD < x or x > SNUMMOD:
+            flags['overflow'] = True
+        ds.append(x)
+
+    def op_div(self, arg): # 24  div 1   DS1 / DS0
+        ds = self.ds
+        flags = self.flags
+        flags['overflow'] = False
+        flags['error'] = False
+        x2 = ds.pop()
+        x1 = ds.pop()
+        if x2 == 0:
+            flags['error'] = True
+            ds.append(0)
+        else:
+            x = (x1 // x2) % 65636
+            if -SNUMMOD < x or x > SNUMMOD:
+                flags['overflow'] = True
+            ds.append(x)
+
+    def op_mod(self, arg): # 25  mod 1   DS1 % DS0
+        ds = self.ds
+        flags = self.flags
+        flags['overflow'] = False
+        x2 = ds.pop()
+        x1 = ds.pop()
+        if x2 == 0:
+            flags['error'] = True
+            ds.append(0)
+        else:
+            x = (x1 % x2) % 65636
+            if -SNUMMOD < x or x > SNUMMOD:
+                flags['overflow'] = True
+            ds.append(x)
+
+    def op_not(self, arg): # 26  not 1   negate !DS0
+        ds = self.ds
+        ds.append( 1 if ds.pop() == 0 else 1)
+
+    def op_random(self, arg): # 27	random	1	random number to DS0
+        self.ds.append( random.randint(0, 65535) )
+
+    def op_jump(self, ip): # 30  jump    3   goto label
+        return ip
+
+    def op_jeq(self, ip): # 31  jeq 3   jump if DS0 == 0
+        if self.ds.pop() == 0:
+            return ip
+
+    def op_jne(self, ip): # 32  jne 3   jump if DS0 != 0
+        if self.ds.pop() != 0:
+            return ip
+
+    def op_jge(self, ip): # 33  jge 3   jump if DS0 >= 0
+        if self.ds.pop() >= 0:
+            return ip
+
+    def op_jgt(self, ip): # 34  jgt 3   jump if DS0 > 0
+        if self.ds.pop() > 0:
+            return ip
+
+    def op_jle(self, ip): # 35  jle 3   jump if DS0 <= 0
+        if self.ds.pop() <= 0:
+            return ip
+
+    def op_jlt(self, ip): # 36  jlt 3   jump if DS0 < 0
+        if self.ds.pop() < 0:
+            return ip
+
+    def op_jof(self, ip): # 37  jof 3   jump if flag 'overflow' is set
+        if self.flags['overflow']:
+            return ip
+
+    def op_jef(self, ip): # 38  jef 3   jump if flag 'error' is set
+        if self.flags['error']:
+            return ip
+
+    def op_calld(self, arg): # 40  calld    3   call subroutine directly by label
+        ip, back = arg
+        self.rs.append(back)
+        return ip
+
+    def op_calli(self, icode): # 41  calli  1   call subroutine indirectly from DS0
+        self.rs.append(icode+1)
+        return self.goto(self.ds.pop())
+
+    def op_return(self, arg): # 42  return  1   return from subroutine
+        return self.goto(self.rs.pop())
+
+    def op_fetch(self, arg): # 50  fetch   2   get value from memory
+        ds = self.ds
+        a = ds.pop()
+        if not 0 <= a < Memlen:
+            raise MachineError("Out of memory size" if a > 0 else "Negative address")
+        ds.append( self.memory[a])
+
+    def op_store(self, arg): # 51  store   2   put value to memory
+        ds = self.ds
+        a = ds.pop()
+        v = ds.pop()
+        if not 0 <= a < Memlen:
+            raise MachineError("Out of memory size" if a > 0 else "Negative address")
+        self.memory[a] = v
+
+    def op_printnum(self, arg): # 60  printnum    1   print number
+        self.write(f"{self.ds.pop()} ")
+
+    def op_printchar(self, arg): # 61  printchar   1   print character
+        self.write(chr(self.ds.pop()))
+
+    def op_println(self, arg): # 62  println 1   print newline
+        self.write("\n")
+
+    def op_show(self, icode): # 63  show    1   show system data
+        self.write(f"show: ds={self.ds.tolist()}, rs={self.rs.tolist()}, {icode=}, flags={self.flags}\n")
+
+    def op_dump(self, icode): # 64  dump    1   dump system data
+        self.write(f"dump: ds={self.ds.tolist()}, rs={self.rs.tolist()}, {icode=}, flags={self.flags}\n")
+        self.write(f"memory={self.memory.tolist()}\n")
+
+    def op_wait(self, arg): # 65  wait   1    wait for enter key
+        self.readline()
+
+    def op_inputnum(self, arg): # 66  inputnum   1   wait for user input, get number
+        self.ds.append(int(self.readline()))
+
+    def op_inputchar(self, arg): # 67  inputchar   1   wait for user input, get character
+        line = self.readline()
+        if not line:
+            raise MachineError("empty line, no character to input")
+        self.ds.append(ord(line[0]))
+
+    def op_printstr(self, arg): # 68  printstr    1   print string from DS0
+        data = self.data
+        x = self.ds.pop()
+        if not 0 <= x < len(data) or x + 1 + data[x] > len(data):
+            raise MachineError(f"bad string address {x}")
+        self.write(str(data[x+1:x+1+data[x]], 'latin-1'))
+
+    def op_char(self, x): # 70  char    2   put char code to DS0
+        self.ds.append(x)
+
+    def op_space(self, arg): # 71  space   1   put space code to DS0
+        self.ds.append(CODE_SPACE)
+
+    def op_string(self, x): # 72  string  1   put Hollerith string address to DS0
+        self.ds.append(x)
+
+    def op_byte(self, x): # 73  byte    2   load number 0.255 to DS
+        self.ds.append(x)
+
+    def op_number(self, x): # 74  number  3   load number -32768..32767
+        self.ds.append(x)
+
+    def op_addr(self, x): # 75  addr   3   load address 0.65536 to DS
+        self.ds.append(x)
+
+    # fused codes, emitted by ksmc -O for do/loop
+
+    def op_jrz(self, ip): # 80  jrz 3   jump if RS0 == 0 (do)
+        if self.rs[-1] == 0:
+            return ip
+
+    def op_djnz(self, ip): # 81  djnz    3   decrement RS0, jump if RS0 != 0 (loop)
+        rs = self.rs
+        flags = self.flags
+        flags['overflow'] = False
+        x = (rs[-1] - 1) % 65636
+        if -SNUMMOD < x or x > SNUMMOD:
+            flags['overflow'] = True
+        rs[-1] = x
+        if x != 0:
+            return ip
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """run program named in command line (default prog01), as a script"""
+
+    parser = argparse.ArgumentParser(description="Stack machine byte code interpreter")
+    parser.add_argument('program', nargs='?', default='prog01',
+                        help="program name, extension is ignored")
+    parser.add_argument('--trace', action='store_true',
+                        help="log every code executed and the stacks to .sml (slow)")
+    parser.add_argument('--output', choices=['both', 'stdout', 'file'], default='both',
+                        help="where program output goes: screen and .smo file (default), or one of them")
+    parser.add_argument('--buffer', type=int, default=8192, metavar='SIZE',
+                        help="output buffer size, chars (1: write at once)")
+    parser.add_argument('--profile', action='store_true',
+                        help="count and time codes executed, write hot spots to .smp")
+    parser.add_argument('--profile-json', default=None, metavar='FILE',
+                        help="with --profile: write all profile numbers to FILE as json")
+    parser.add_argument('--profile-stacks', default=None, metavar='FILE',
+                        help="with --profile: write collapsed call stacks to FILE for flame graphs")
+    parser.add_argument('--steps', type=int, default=None,
+                        help="pause after this many codes")
+    parser.add_argument('--save', default=None, metavar='FILE',
+                        help="if paused by --steps, save machine state to FILE")
+    parser.add_argument('--resume', default=None, metavar='FILE',
+                        help="go on from machine state saved in FILE, not from the start")
+    parser.add_argument('--log', choices=CHOICES, default='WARNING', type=str.upper,
+                        help="least level written to .sml (default WARNING: errors only; "
+                             "the file is made only if there is something to write)")
+    args = parser.parse_args(argv)
+
+    # in/out file names
+
+    inout = args.program
+
+    if len(inout) > 4 and inout[-4] == '.':
+        inout = inout[:-4]
+
+    inname  = inout + '.smb'     # state machine program text
+    logname = inout + '.sml'     # state machine program log
+    outname = inout + '.smo'     # state machine program output
+    profname = inout + '.smp'    # state machine program profile
+
+    # trace goes to the log at level INFO
+    loglevel = args.log
+    if args.trace and (loglevel == ksmlog.OFF or ksmlog.LEVELS[loglevel] > ksmlog.LEVELS['INFO']):
+        loglevel = 'INFO'
+    ksmlog.setup((sys.stderr, 'WARNING'), (logname, loglevel))
+
+    logger.info(f"Files: {inout=}, {inname=}, {outname=}, {logname=}")
+
+    # map file with program, pages are read as the code is decoded;
+    # or read machine state saved before
+
+    if args.resume:
+        logger.info(f"Reading machine state from {args.resume} ...")
+        with open(args.resume, 'rb') as snapfile:
+            snap = snapfile.read()
+    else:
+        logger.info(f"Reading code file from {inname} ...")
+        cf = ksmobj.map_file(inname)
+    logger.info("done.")
+
+    # make output
+
+    logger.info(f"Writing log text to {logname}.")
+
+    with open(outname, 'at' if args.resume else 'wt') as outfile:
+
+        out = Output(stdout=args.output != 'file',
+                     file=outfile if args.output != 'stdout' else None,
+                     bufsize=args.buffer)
+        vm = VM(out, trace=args.trace, profile=args.profile)
+
+        try:
+            if args.resume:
+                vm.restore(snap)
+            else:
+                vm.load(cf)
+        except LoadError as e:
+            print(e)
+            logger.error(str(e))
+            raise SystemExit
+
+        state = vm.run(args.steps)
+
+    if state == 'paused':
+        print(f"\nPaused after {vm.steps} codes.", end='')
+        logger.info(f"Paused after {vm.steps} codes.")
+        if args.save:
+            with open(args.save, 'wb') as snapfile:
+                snapfile.write(vm.snapshot())
+            print(f" Machine state saved to {args.save}.", end='')
+            logger.info(f"Machine state saved to {args.save}.")
+
+    if vm.profiler is not None:
+        with open(profname, 'wt') as proffile:
+            proffile.write(vm.profiler.report())
+        logger.info(f"Profile written to {profname}.")
+        if args.profile_json:
+            import json     # only here, not on every start
+            with open(args.profile_json, 'wt') as jsonfile:
+                json.dump(vm.profiler.to_dict(), jsonfile, indent=2)
+        if args.profile_stacks:
+            with open(args.profile_stacks, 'wt') as stacksfile:
+                stacksfile.write(vm.profiler.collapsed())
+
+    print()
+    print()
+    logger.info("Job done.")
+
+if __name__ == '__main__':
+    main()
 
 # --------------------------------------------------------------
 # end of code
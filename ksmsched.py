@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmsched, много программ в одном процессе по очереди
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# setup
+
+QUANTUM = 1000      # codes a program runs before the next one gets its turn
+
+# --------------------------------------------------------------
+# imports
+
+import json
+import time
+import argparse
+from collections import deque
+
+from ksmr import VM, Output, Input, LoadError
+from ksmbatch import program_names, summary
+import ksmlog
+
+# --------------------------------------------------------------
+# sessions and the scheduler
+
+class Session:
+    """one program in the scheduler: its machine, with input fed by the
+    scheduler and output kept in memory
+    """
+
+    def __init__(self, name: str, vm: VM, max_steps: int | None = None):
+        self.name = name
+        self.vm = vm
+        self.max_steps = max_steps      # stop after this many codes
+        self.reason = None              # why it is done: stopped, error, steps, blocked
+        self.t0 = time.perf_counter()
+        self.elapsed = 0.0
+
+    def result(self) -> dict:
+        """what happened, as ksmbatch tells it"""
+
+        vm = self.vm
+        return {'program': self.name, 'reason': self.reason, 'error': vm.error,
+                'steps': vm.steps, 'output': vm.out.getvalue(), 'elapsed': self.elapsed}
+
+class Scheduler:
+    """many machines in one process, each runs in turn for quantum codes
+
+    Machines that want input when there is none are parked, and go back
+    to the queue when feed() gives them some; they take no time while
+    parked. Finished sessions go to done.
+    """
+
+    def __init__(self, quantum: int = QUANTUM):
+        self.quantum = quantum
+        self.ready = deque()        # sessions to run, in turn
+        self.parked = {}            # name -> session waiting for input
+        self.sessions = {}          # name -> session, all not done
+        self.done = []              # sessions done, in order they finished
+
+    def add(self, name: str, cf, max_steps: int | None = None) -> Session:
+        """new session running code file cf, raise LoadError if it is bad"""
+
+        if name in self.sessions:
+            raise ValueError(f"session {name} is already there")
+        vm = VM(Output(stdout=False, capture=True), inp=Input(interactive=False))
+        vm.load(cf)
+        session = Session(name, vm, max_steps)
+        self.sessions[name] = session
+        self.ready.append(session)
+        return session
+
+    def feed(self, name: str, text: str) -> None:
+        """give lines of input to session name, wake it if it is parked"""
+
+        self.sessions[name].vm.inp.feed(text)
+        if name in self.parked:
+            self.ready.append(self.parked.pop(name))
+
+    def finish(self, session: Session, reason: str) -> None:
+        """session is done for reason"""
+
+        session.reason = reason
+        session.elapsed = time.perf_counter() - session.t0
+        del self.sessions[session.name]
+        self.parked.pop(session.name, None)
+        self.done.append(session)
+
+    def step(self) -> Session | None:
+        """run the next session for one quantum and put it where it
+        belongs then; return it, None if no session is ready
+        """
+
+        if not self.ready:
+            return None
+
+        session = self.ready.popleft()
+        vm = session.vm
+        n = self.quantum
+        if session.max_steps is not None:
+            n = min(n, session.max_steps - vm.steps)
+
+        try:
+            state = vm.run(n)
+        except Exception as e:
+            # one bad session must not take the others down
+            vm.state = 'error'
+            vm.error = f"{type(e).__name__}: {e}"
+            state = 'error'
+
+        match state:
+            case 'paused' if session.max_steps is not None and vm.steps >= session.max_steps:
+                self.finish(session, 'steps')
+            case 'paused':
+                self.ready.append(session)
+            case 'blocked':
+                self.parked[session.name] = session
+            case state:
+                self.finish(session, state)
+
+        return session
+
+    def run(self) -> None:
+        """run sessions until all are done or parked"""
+
+        while self.ready:
+            self.step()
+
+    def close(self) -> None:
+        """sessions still parked are done, blocked for ever"""
+
+        for session in list(self.parked.values()):
+            self.finish(session, 'blocked')
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """run programs given by names or globs in one process, print a summary"""
+
+    parser = argparse.ArgumentParser(description="Run many stack machine programs in one process, in turn")
+    parser.add_argument('programs', nargs='+',
+                        help="program names or globs, e.g. 'progs/*.smb'")
+    parser.add_argument('-q', '--quantum', type=int, default=QUANTUM,
+                        help=f"codes a program runs in its turn (default {QUANTUM})")
+    parser.add_argument('--copies', type=int, default=1,
+                        help="run each program this many times at once")
+    parser.add_argument('--steps', type=int, default=None,
+                        help="stop each program after this many codes")
+    parser.add_argument('--input', default=None, metavar='FILE',
+                        help="text fed to each program that waits for input")
+    parser.add_argument('--json', default=None, metavar='FILE',
+                        help="write all results, with full output, to FILE")
+    args = parser.parse_args(argv)
+
+    ksmlog.setup()
+
+    names = program_names(args.programs)
+    if not names:
+        print("No programs found.")
+        raise SystemExit(1)
+
+    text = None
+    if args.input:
+        with open(args.input, 'rt') as inputfile:
+            text = inputfile.read()
+
+    t0 = time.perf_counter()
+    scheduler = Scheduler(args.quantum)
+    failed = []
+    for name in names:
+        try:
+            # read once, the copies share it
+            with open(name + '.smb', 'rb') as infile:
+                cf = infile.read()
+            for i in range(args.copies):
+                sname = name if args.copies == 1 else f"{name}#{i}"
+                scheduler.add(sname, cf, args.steps)
+        except (OSError, LoadError) as e:
+            failed.append({'program': name, 'reason': 'load', 'error': str(e),
+                           'steps': 0, 'output': '', 'elapsed': 0.0})
+
+    scheduler.run()
+    if text is not None:
+        for sname in list(scheduler.parked):
+            scheduler.feed(sname, text)
+        scheduler.run()
+    scheduler.close()
+    t = time.perf_counter() - t0
+
+    results = failed + [s.result() for s in scheduler.done]
+    if args.copies == 1:
+        print(summary(results))
+    else:
+        print(summary(results).rsplit('\n', 1)[-1].strip())
+    steps = sum(r['steps'] for r in results)
+    print(f"{len(results)} sessions, {steps} codes in {t:.3f} s ({steps / t:.0f} codes/s)")
+
+    if args.json:
+        with open(args.json, 'wt') as jsonfile:
+            json.dump(results, jsonfile, indent=2)
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------
@@ -0,0 +1,2 @@
+#!/usr/bin/bash
+uv run ksmsched.py $1 $2 $3 $4 $5 $6 $7 $8 $9
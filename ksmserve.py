@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# Mikhail (myke) Kolodin
+# 2026-10-17 1.0.8
+
+# --------------------------------------------------------------
+# Стековая машина - Stack machine
+# ksmserve, сервер: компиляция и выполнение программ в пуле готовых процессов
+# --------------------------------------------------------------
+
+# --------------------------------------------------------------
+# protocol
+#
+# Unix socket (default) or localhost TCP; a request is one line of JSON,
+# the answer is one line of JSON; a connection may send many requests.
+#
+# request:
+#   op       'compile', 'run' or 'compile_run' (default)
+#   source   program text, for compile and compile_run
+#   code     code file, base64, for run
+#   optlev   optimization level (0), format: code file format ('11')
+#   input    text the program reads (''), it is never asked for more
+#   steps    stop after this many codes
+#   timeout  stop after this many seconds, at most the server's limit
+#
+# answer:
+#   ok           false if the request itself is bad, see error
+#   reason       why it ended: stopped, error, blocked, steps, timeout,
+#                compile (has errors), load (bad code file), compiled
+#   error        error message or None
+#   steps        codes executed
+#   output       program output
+#   diagnostics  compiler errors and warnings, as Compiler.diagnostics
+#   code         compiled code file, base64, for compile
+#   elapsed      seconds spent in the worker
+
+# --------------------------------------------------------------
+# setup
+
+TIMEOUT  = 10.0         # most seconds a request may run
+PROGRAMS = 1024         # compiled programs kept in each worker
+MAXLINE  = 1 << 26      # longest request line, bytes
+
+# --------------------------------------------------------------
+# imports: the standard library only, so that clients start fast;
+# the machine is imported by the server and the workers
+
+import os
+import sys
+import json
+import time
+import base64
+import signal
+import socket
+import asyncio
+import argparse
+
+# same directory as the compiled code cache of ksmc
+SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'ksm', 'server.sock')
+
+# --------------------------------------------------------------
+# worker processes
+
+_compilers = {}     # (optlev, fmt) -> Compiler
+_programs  = {}     # (source, optlev, fmt) -> (code file, diagnostics)
+_cache_dir = None   # compiled code cache directory, None for no cache
+
+def init_worker(cache_dir: str | None) -> None:
+    """worker start up: no logging, compiled code cache to use"""
+
+    global _cache_dir
+    import ksmlog
+    ksmlog.setup()
+    _cache_dir = cache_dir
+
+def compile_source(source: str, optlev: int, fmt: str) -> tuple[bytes, list[dict]]:
+    """code file and diagnostics for program text source, compiled once
+    per worker and then taken from memory
+    """
+
+    from ksmc import Compiler, open_cache
+
+    key = (source, optlev, fmt)
+    found = _programs.get(key)
+    if found is not None:
+        return found
+
+    compiler = _compilers.get((optlev, fmt))
+    if compiler is None:
+        cache = open_cache(_cache_dir) if _cache_dir else None
+        compiler = _compilers[optlev, fmt] = Compiler(optlev, cache=cache, fmt=fmt)
+
+    cf = compiler.compile(source)
+    found = (cf, compiler.diagnostics)
+    if not compiler.errors:
+        if len(_programs) >= PROGRAMS:
+            del _programs[next(iter(_programs))]
+        _programs[key] = found
+    return found
+
+def handle(request: dict, limit: float = TIMEOUT) -> dict:
+    """do one request in a worker, return the answer"""
+
+    from ksmc import version
+    from ksmr import VM, Output, Input, LoadError
+    from ksmbatch import run_limited
+
+    t0 = time.perf_counter()
+    answer = {'ok': True, 'reason': None, 'error': None, 'steps': 0,
+              'output': '', 'diagnostics': [], 'elapsed': 0.0}
+
+    try:
+        op = request.get('op', 'compile_run')
+        if op not in ('compile', 'run', 'compile_run'):
+            raise ValueError(f"unknown op: {op}")
+
+        if op == 'run':
+            cf = base64.b64decode(request['code'], validate=True)
+        else:
+            cf, diagnostics = compile_source(request['source'],
+                                             int(request.get('optlev', 0)),
+                                             str(request.get('format', version)))
+            answer['diagnostics'] = diagnostics
+            errors = [d for d in diagnostics if d['level'] == 'error']
+            if errors:
+                d = errors[0]
+                answer['reason'] = 'compile'
+                answer['error'] = f"{d['message']} (line {d['line']})" if d['line'] else d['message']
+            elif op == 'compile':
+                answer['reason'] = 'compiled'
+                answer['code'] = base64.b64encode(cf).decode('ascii')
+
+        if op != 'compile' and answer['reason'] is None:
+            out = Output(stdout=False, capture=True)
+            vm = VM(out, inp=Input(interactive=False))
+            vm.inp.feed(request.get('input', ''))
+            timeout = min(float(request.get('timeout', limit)), limit)
+            steps = request.get('steps')
+            try:
+                vm.load(cf)
+                answer['reason'] = run_limited(vm, None if steps is None else int(steps),
+                                               t0 + timeout)
+                answer['error'] = vm.error
+            except LoadError as e:
+                answer['reason'] = 'load'
+                answer['error'] = str(e)
+            answer['steps'] = vm.steps
+            answer['output'] = out.getvalue()
+
+    except (KeyError, TypeError, ValueError) as e:
+        # binascii.Error of bad base64 is a ValueError too
+        answer['ok'] = False
+        answer['error'] = f"bad request: {type(e).__name__}: {e}"
+
+    except Exception as e:
+        # anything else still gets an answer, the connection goes on
+        answer['ok'] = False
+        answer['error'] = f"{type(e).__name__}: {e}"
+
+    answer['elapsed'] = time.perf_counter() - t0
+    return answer
+
+def warm() -> None:
+    """nothing to do, makes the pool start its workers and waits for them"""
+
+# --------------------------------------------------------------
+# server
+
+async def serve(path: str | None = SOCKET, port: int | None = None,
+                workers: int | None = None, limit: float = TIMEOUT,
+                cache_dir: str | None = None) -> None:
+    """answer requests on Unix socket path, or on localhost TCP port,
+    until stopped; requests are done by a pool of worker processes
+    """
+
+    from functools import partial
+    from concurrent.futures import ProcessPoolExecutor
+    from ksmlog import logger
+
+    # loaded before the pool starts its workers, so they have it all ready
+    import ksmc         # noqa: F401
+    import ksmr         # noqa: F401
+    import ksmbatch     # noqa: F401
+
+    workers = workers or os.cpu_count()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                               initargs=(cache_dir,))
+    loop = asyncio.get_running_loop()
+    # kill stops the server as Ctrl-C does, the socket file is removed
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await asyncio.gather(*(loop.run_in_executor(pool, warm) for _ in range(workers)))
+    logger.info(f"{workers} workers ready")
+
+    async def connection(reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request is not an object")
+                except ValueError as e:
+                    answer = {'ok': False, 'error': f"bad request: {e}"}
+                else:
+                    try:
+                        answer = await loop.run_in_executor(pool, partial(handle, request, limit))
+                    except Exception as e:
+                        # the worker itself failed, e.g. the pool is broken
+                        logger.error(f"Worker failed: {type(e).__name__}: {e}")
+                        answer = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                    else:
+                        logger.info(f"{request.get('op', 'compile_run')}: {answer['reason']}, "
+                                    f"{answer['steps']} codes, {answer['elapsed'] * 1000:.2f} ms")
+                writer.write(json.dumps(answer).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            # client went away, or sent a line longer than MAXLINE
+            logger.info(f"Connection dropped: {type(e).__name__}: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    if port is not None:
+        server = await asyncio.start_server(connection, '127.0.0.1', port, limit=MAXLINE)
+        where = f"127.0.0.1:{port}"
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(connection, path, limit=MAXLINE)
+        where = path
+
+    logger.info(f"Serving on {where}")
+    print(f"Serving on {where} with {workers} workers, Ctrl-C to stop.")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if port is None and os.path.exists(path):
+            os.unlink(path)
+
+# --------------------------------------------------------------
+# client
+
+def connect(path: str | None = SOCKET, port: int | None = None) -> socket.socket:
+    """connection to the server on Unix socket path or localhost TCP port"""
+
+    if port is not None:
+        return socket.create_connection(('127.0.0.1', port))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+def call(request: dict, path: str | None = SOCKET, port: int | None = None,
+         sock: socket.socket | None = None) -> dict:
+    """send request to the server, return its answer; with sock given,
+    use that connection (see connect()) and leave it open
+    """
+
+    own = sock is None
+    if own:
+        sock = connect(path, port)
+    try:
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        data = bytearray()
+        while not data.endswith(b'\n'):
+            part = sock.recv(1 << 16)
+            if not part:
+                raise ConnectionError("server closed connection")
+            data.extend(part)
+        return json.loads(data)
+    finally:
+        if own:
+            sock.close()
+
+# --------------------------------------------------------------
+# command line
+
+def main(argv: list[str] | None = None) -> None:
+    """serve, or send a program to the server"""
+
+    parser = argparse.ArgumentParser(description="Stack machine server with a pool of worker processes")
+    parser.add_argument('--socket', default=SOCKET, metavar='PATH',
+                        help=f"Unix socket (default {SOCKET})")
+    parser.add_argument('--port', type=int, default=None,
+                        help="use localhost TCP port, not Unix socket")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    s = commands.add_parser('serve', help="answer requests until stopped")
+    s.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                   help="worker processes (default: number of CPUs)")
+    s.add_argument('--timeout', type=float, default=TIMEOUT,
+                   help=f"most seconds a request may run (default {TIMEOUT})")
+    s.add_argument('--no-cache', dest='cache', action='store_false',
+                   help="do not use the compiled code cache of ksmc")
+    s.add_argument('--cache-dir', default=None, metavar='DIR',
+                   help="compiled code cache directory (default as for ksmc)")
+    s.add_argument('-v', '--verbose', action='store_true',
+                   help="log each request to stderr")
+
+    c = commands.add_parser('send', help="compile and/or run a program on the server")
+    c.add_argument('program', help="program: .smt is compiled and run, .smb is run")
+    c.add_argument('--compile', action='store_true',
+                   help="only compile, write the code file (.smb)")
+    c.add_argument('-O', dest='optlev', type=int, default=0, metavar='LEVEL',
+                   help="optimization level, as for ksmc")
+    c.add_argument('--format', dest='fmt', default=None,
+                   help="code file format, as for ksmc")
+    c.add_argument('--steps', type=int, default=None,
+                   help="stop after this many codes")
+    c.add_argument('--timeout', type=float, default=None,
+                   help="stop after this many seconds")
+    c.add_argument('--input', default=None, metavar='FILE',
+                   help="text the program reads")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        import ksmlog
+        ksmlog.setup((sys.stderr, 'INFO' if args.verbose else 'WARNING'))
+        cache_dir = None
+        if args.cache:
+            from ksmc import CACHE_DIR
+            cache_dir = args.cache_dir or CACHE_DIR
+        try:
+            asyncio.run(serve(args.socket, args.port, args.workers, args.timeout, cache_dir))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        return
+
+    name = args.program
+    if name.endswith('.smb'):
+        with open(name, 'rb') as infile:
+            request = {'op': 'run', 'code': base64.b64encode(infile.read()).decode('ascii')}
+    else:
+        if not name.endswith('.smt'):
+            name += '.smt'
+        with open(name, 'rt') as infile:
+            request = {'op': 'compile' if args.compile else 'compile_run',
+                       'source': infile.read(), 'optlev': args.optlev}
+        if args.fmt:
+            request['format'] = args.fmt
+
+    if args.input:
+        with open(args.input, 'rt') as inputfile:
+            request['input'] = inputfile.read()
+    if args.steps is not None:
+        request['steps'] = args.steps
+    if args.timeout is not None:
+        request['timeout'] = args.timeout
+
+    answer = call(request, args.socket, args.port)
+
+    if answer.get('code') is not None:
+        outname = name[:-4] + '.smb'
+        with open(outname, 'wb') as outfile:
+            outfile.write(base64.b64decode(answer['code']))
+        print(f"Code file written to {outname}")
+    else:
+        print(answer.get('output', ''), end='')
+
+    if not answer['ok'] or answer['reason'] in ('error', 'compile', 'load'):
+        print(f"\nError: {answer['error']}")
+        raise SystemExit(1)
+    if answer['reason'] in ('steps', 'timeout', 'blocked'):
+        print(f"\nStopped: {answer['reason']}, {answer['steps']} codes")
+    elif answer['reason'] != 'compiled':
+        print()
+
+if __name__ == '__main__':
+    main()
+
+# --------------------------------------------------------------
+# end of code
+# --------------------------------------------------------------